@@ -0,0 +1,147 @@
+# admission.py
+"""Admission control for the expensive explanation stages (SHAP, plots, PDF).
+
+At most MRP_EXPLAIN_CONCURRENCY explanations run at once. Up to
+MRP_EXPLAIN_QUEUE more requests may wait, each for at most
+MRP_EXPLAIN_QUEUE_TIMEOUT seconds, for a free slot. Anything beyond that is
+shed: the page still shows the prediction straight away and offers the
+explanation as a deferred "explanation queued" section the user can load once
+the server has capacity.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+EXPLAIN_CONCURRENCY = int(os.environ.get("MRP_EXPLAIN_CONCURRENCY", "2"))
+EXPLAIN_QUEUE = int(os.environ.get("MRP_EXPLAIN_QUEUE", "4"))
+EXPLAIN_QUEUE_TIMEOUT = float(os.environ.get("MRP_EXPLAIN_QUEUE_TIMEOUT", "2.0"))  # seconds
+
+
+class AdmissionController:
+    def __init__(self, concurrency=EXPLAIN_CONCURRENCY, queue_size=EXPLAIN_QUEUE, queue_timeout=EXPLAIN_QUEUE_TIMEOUT):
+        self.concurrency = max(1, int(concurrency))
+        self.queue_size = max(0, int(queue_size))
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._waiting = 0
+        self.counters = {
+            "admitted": 0,          # ran immediately or after queueing
+            "queued": 0,            # had to wait for a slot
+            "shed": 0,              # rejected: queue full
+            "timed_out": 0,         # waited but no slot within the timeout
+            "deferred": 0,          # shown as "explanation queued" instead
+            "deferred_loaded": 0,   # deferred explanations loaded later
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    @contextmanager
+    def admit(self, wait=True):
+        """Yield True if the caller may run the expensive work now, else False."""
+        acquired = self._slots.acquire(blocking=False)
+        if not acquired and wait:
+            with self._lock:
+                full = self._waiting >= self.queue_size
+                if not full:
+                    self._waiting += 1
+                    self.counters["queued"] += 1
+            if full:
+                self._count("shed")
+            else:
+                try:
+                    acquired = self._slots.acquire(timeout=self.queue_timeout)
+                finally:
+                    with self._lock:
+                        self._waiting -= 1
+                if not acquired:
+                    self._count("timed_out")
+        elif not acquired:
+            self._count("shed")
+
+        if not acquired:
+            yield False
+            return
+        with self._lock:
+            self._running += 1
+            self.counters["admitted"] += 1
+        try:
+            yield True
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._running,
+                "waiting": self._waiting,
+                "concurrency": self.concurrency,
+                "queue_size": self.queue_size,
+                **self.counters,
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+    return _controller
+
+
+# ---------------- Streamlit helpers ----------------
+def run_or_defer(render_explanation, key):
+    """Run `render_explanation()` now if admitted; otherwise show it as queued."""
+    controller = get_admission_controller()
+    with controller.admit() as admitted:
+        if admitted:
+            render_explanation()
+            return True
+    controller._count("deferred")
+    _render_deferred(controller, render_explanation, key)
+    return False
+
+
+def _render_deferred(controller, render_explanation, key):
+    import streamlit as st
+
+    # A fragment reruns on its own, so loading the explanation later does not
+    # redo the prediction above it.
+    @st.fragment
+    def deferred():
+        if st.session_state.get(f"load_explanation_{key}"):
+            with controller.admit() as admitted:
+                if admitted:
+                    render_explanation()
+                    controller._count("deferred_loaded")
+                    return
+        st.info(
+            "⏳ Explanation queued: the server is busy, so the charts and PDF report "
+            "are not ready yet. The prediction above is complete."
+        )
+        st.button("Load explanation", key=f"load_explanation_{key}")
+
+    deferred()
+
+
+def render_admission_stats():
+    import streamlit as st
+
+    s = get_admission_controller().stats()
+    st.markdown(
+        f"**Explanations:** {s['running']}/{s['concurrency']} running, {s['waiting']}/{s['queue_size']} waiting"
+    )
+    st.markdown(
+        f"admitted {s['admitted']} · queued {s['queued']} · shed {s['shed']} · "
+        f"timed out {s['timed_out']} · deferred {s['deferred']} · loaded later {s['deferred_loaded']}"
+    )
@@ -1,10 +1,19 @@
 # app.py
+import os
+
 import streamlit as st
 
 from utils import apply_global_css
 from home_page import render_home
 from general_model_page import render_general_model
 from pregnancy_model_page import render_pregnancy_model
+from combined_model_page import render_combined_model
+from warmup import warm_up
+from model_registry import get_registry
+from memory_guard import render_memory_diagnostics
+from admission import render_admission_stats
+from profiling import render_profiling_toggle, run_profiled
+from drift_monitor import render_drift_alerts, render_drift_status
 
 st.set_page_config(
     page_title="Maternal Risk Prediction",
@@ -14,6 +23,11 @@ st.set_page_config(
 
 apply_global_css()
 
+# Load models/explainers and run one dummy request per process before the
+# first real prediction (no-op after the first run; see warmup.py).
+with st.spinner("Loading models..."):
+    warm_up()
+
 # ---------------- Session state ----------------
 if "page" not in st.session_state:
     st.session_state["page"] = "Home"
@@ -26,6 +40,7 @@ st.sidebar.markdown(
 1. Start on the **Home** screen and choose one of the two models:  
    - *General Maternal Model* – for overall maternal health.  
    - *Pregnancy / Antenatal Model* – for clinic visits during pregnancy.  
+   - *Combined Antenatal Assessment* – both models from one form, one report.  
 
 2. Fill in the numeric inputs and toggles with the patient’s information.  
 
@@ -40,6 +55,34 @@ _Created by **Mrinal Basak Shuvo**._
 """
 )
 
+# ---------------- Model version ----------------
+# Picks up newly deployed model versions in the background (see model_registry.py).
+registry = get_registry()
+registry.refresh()
+status = registry.status()
+version_note = f"Model version: **{status['active']}**"
+if status["loading"]:
+    version_note += f" (loading {status['loading']}...)"
+if status["pinned"]:
+    version_note += " (pinned)"
+st.sidebar.caption(version_note)
+if status["last_error"]:
+    st.sidebar.caption(f"Last model update failed: {status['last_error']}")
+
+# ---------------- Input drift (see drift_monitor.py) ----------------
+render_drift_alerts()
+
+# ---------------- Diagnostics (MRP_DIAGNOSTICS=1 or ?diagnostics=1) ----------------
+if os.environ.get("MRP_DIAGNOSTICS") == "1" or "diagnostics" in st.query_params:
+    with st.sidebar.expander("Memory diagnostics"):
+        render_memory_diagnostics()
+    with st.sidebar.expander("Explanation load"):
+        render_admission_stats()
+    with st.sidebar.expander("Input drift"):
+        render_drift_status()
+    with st.sidebar.expander("Profiling"):
+        render_profiling_toggle()
+
 # ---------------- Title & welcome text ----------------
 st.markdown(
     '<div class="main-title">Maternal Risk Prediction</div>',
@@ -55,11 +98,17 @@ if st.session_state["page"] == "Home":
     )
 
 # ---------------- Routing ----------------
-page = st.session_state["page"]
+def render_page(page):
+    if page == "Home":
+        render_home()
+    elif page == "General":
+        render_general_model()
+    elif page == "Pregnancy":
+        render_pregnancy_model()
+    elif page == "Combined":
+        render_combined_model()
 
-if page == "Home":
-    render_home()
-elif page == "General":
-    render_general_model()
-elif page == "Pregnancy":
-    render_pregnancy_model()
+
+# Opt-in cProfile of this rerun (see profiling.py); a plain call otherwise.
+page = st.session_state["page"]
+run_profiled(render_page, page, label=page)
@@ -0,0 +1,204 @@
+# audit_log.py
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# ---------------- Configuration (environment overrides) ----------------
+AUDIT_DB_PATH = os.environ.get("MRP_AUDIT_DB", "audit_log.db")
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("MRP_AUDIT_FLUSH_INTERVAL", "2.0"))  # seconds
+AUDIT_FLUSH_SIZE = int(os.environ.get("MRP_AUDIT_FLUSH_SIZE", "200"))  # rows per insert batch
+AUDIT_MAX_QUEUE = int(os.environ.get("MRP_AUDIT_MAX_QUEUE", "10000"))  # pending rows kept in memory
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    logged_at TEXT NOT NULL,
+    model TEXT NOT NULL,
+    label TEXT NOT NULL,
+    confidence REAL,
+    inputs TEXT NOT NULL,
+    model_version TEXT
+)
+"""
+
+_STOP = object()
+
+
+class AuditLogger:
+    """Queue-backed prediction log.
+
+    `log()` only enqueues and returns immediately; a background thread owns the
+    SQLite connection and inserts rows in batches of `flush_size` or every
+    `flush_interval` seconds, whichever comes first. The queue is bounded:
+    when it is full new records are dropped (and counted) rather than making
+    the caller wait.
+    """
+
+    def __init__(
+        self,
+        db_path=AUDIT_DB_PATH,
+        flush_interval=AUDIT_FLUSH_INTERVAL,
+        flush_size=AUDIT_FLUSH_SIZE,
+        max_queue=AUDIT_MAX_QUEUE,
+    ):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_size = max(1, int(flush_size))
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._count_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self._closed = False
+        self._failed = False  # the database could not be opened
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    # ---------------- Producer side (request path) ----------------
+    def log(self, model_name, input_dict, pred_label, confidence=None, model_version=None):
+        if self._failed:
+            with self._count_lock:
+                self.dropped += 1
+            return False
+        if self._closed:
+            return False
+        record = (
+            datetime.now().isoformat(timespec="milliseconds"),
+            str(model_name),
+            str(pred_label),
+            None if confidence is None else float(confidence),
+            json.dumps(input_dict, default=float),
+            None if model_version is None else str(model_version),
+        )
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            with self._count_lock:
+                self.dropped += 1
+            return False
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def close(self, timeout=10.0):
+        """Flush everything still queued and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        if not self._thread.is_alive():
+            return
+        # The sentinel must get in even if the queue is full, so wait for room;
+        # close() only runs at shutdown, never on the request path.
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.error("Audit writer did not drain its queue; %d records lost", self.pending())
+            return
+        self._thread.join(timeout)
+
+    # ---------------- Consumer side (writer thread) ----------------
+    def _run(self):
+        try:
+            conn = self._connect()
+        except sqlite3.Error:
+            logger.exception("Audit log database %s could not be opened; predictions will not be logged", self.db_path)
+            self._fail()
+            return
+
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        stopping = False
+        while not stopping:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            except queue.Empty:
+                pass
+
+            if stopping or len(batch) >= self.flush_size or time.monotonic() >= deadline:
+                # Drain whatever else is already waiting before writing, so a
+                # burst lands in as few transactions as possible.
+                while not stopping and len(batch) < self.flush_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                    else:
+                        batch.append(item)
+                if batch:
+                    self._write(conn, batch)
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute(_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(predictions)")}
+            if "model_version" not in columns:  # databases created before versioning
+                conn.execute("ALTER TABLE predictions ADD COLUMN model_version TEXT")
+            conn.commit()
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+    def _fail(self):
+        # No writer any more: drop what is queued and everything logged later.
+        self._failed = True
+        lost = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                lost += 1
+        with self._count_lock:
+            self.dropped += lost
+
+    def _write(self, conn, batch):
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO predictions (logged_at, model, label, confidence, inputs, model_version) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    batch,
+                )
+            with self._count_lock:
+                self.written += len(batch)
+        except sqlite3.Error:
+            logger.exception("Audit log write failed; %d records lost", len(batch))
+            with self._count_lock:
+                self.dropped += len(batch)
+
+
+# ---------------- Process-wide instance ----------------
+_instance = None
+_instance_lock = threading.Lock()
+
+
+def get_audit_logger():
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = AuditLogger()
+                atexit.register(_instance.close)
+    return _instance
@@ -0,0 +1,484 @@
+# batch_score.py
+"""Sharded, resumable batch scoring for large screening files.
+
+    python batch_score.py plan screening.csv --job jobs/screening --shard-rows 5000
+    python batch_score.py work jobs/screening --processes 4     # on any number of machines
+    python batch_score.py status jobs/screening
+    python batch_score.py merge jobs/screening scored.csv
+
+"plan" splits the input CSV into shard files and writes manifest.json. The
+manifest pins the model version, so every worker scores with the same models.
+Each model is scored if the file has all of its feature columns. A
+"Diastolic" column is accepted for "Diastolic_BP" and the other way round.
+`--explain approx` uses the fast approximate attributions instead of exact
+SHAP (see explain_eval.py).
+
+"work" can run on any machine that sees the job directory (a shared
+filesystem). A worker claims a shard by creating leases/<shard>.lease with
+O_CREAT|O_EXCL, so only one claim can succeed. While it scores, it refreshes
+the lease's mtime. It writes out/<shard>.csv to a temporary file and renames
+it into place, and only then drops the lease. A shard counts as done once its
+output file exists, so a rerun after a crash skips completed shards. When a
+worker dies, its lease stops being refreshed. After --lease-seconds another
+worker renames the stale lease away and takes the shard over.
+
+If two workers steal the same expired lease at the same moment, the shard may
+be scored twice. Both write the same file, so this costs time, not
+correctness. A shard that raises is recorded in failed/<shard>.json and
+skipped until `work --retry-failed`.
+
+Output rows keep every input column. Each model adds <model>_label,
+<model>_confidence, one <model>_p_<class> column per class, the three
+strongest SHAP factors in <model>_top_factors, and one <model>_shap_<feature>
+column per feature. Rows that fail validation get <model>_error instead.
+"""
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+
+from feature_schema import SCHEMAS, validate_and_encode
+from model_registry import discover_versions, load_bundle
+from prefork_pool import worker_nthread
+from utils import (
+    EXPLAIN_MODE,
+    EXPLAIN_MODES,
+    FEATURES_DS2,
+    FEATURES_DS3,
+    format_risk_label,
+    score_batch,
+    set_model_nthread,
+)
+
+FEATURES = {"ds2": FEATURES_DS2, "ds3": FEATURES_DS3}
+# Both models measure diastolic BP under different column names.
+ALIASES = {"Diastolic_BP": "Diastolic", "Diastolic": "Diastolic_BP"}
+LEASE_SECONDS = float(os.environ.get("MRP_BATCH_LEASE_SECONDS", "120"))
+MANIFEST = "manifest.json"
+
+
+# ---------------- Job directory layout ----------------
+def _path(job_dir, *parts):
+    return os.path.join(job_dir, *parts)
+
+
+def shard_input(job_dir, shard_id):
+    return _path(job_dir, "shards", f"{shard_id}.csv")
+
+
+def shard_output(job_dir, shard_id):
+    return _path(job_dir, "out", f"{shard_id}.csv")
+
+
+def lease_path(job_dir, shard_id):
+    return _path(job_dir, "leases", f"{shard_id}.lease")
+
+
+def failed_path(job_dir, shard_id):
+    return _path(job_dir, "failed", f"{shard_id}.json")
+
+
+def _write_atomic(path, write):
+    # Write next to the target, then rename: readers never see a partial file.
+    tmp = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(tmp, "w", newline="") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_manifest(job_dir):
+    with open(_path(job_dir, MANIFEST)) as f:
+        return json.load(f)
+
+
+def _column_for(feature, header):
+    if feature in header:
+        return feature
+    alias = ALIASES.get(feature)
+    return alias if alias in header else None
+
+
+# ---------------- Plan ----------------
+def plan(input_path, job_dir, shard_rows=5000, models=None, version=None, explain=EXPLAIN_MODE):
+    manifest_file = _path(job_dir, MANIFEST)
+    if os.path.exists(manifest_file):
+        manifest = read_manifest(job_dir)
+        if os.path.abspath(input_path) != manifest["input"]:
+            raise ValueError(f"{job_dir} already holds a job for {manifest['input']}")
+        return manifest  # re-planning the same input is a no-op
+
+    with open(input_path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        available = [
+            key for key in SCHEMAS if all(_column_for(name, header) for name in FEATURES[key])
+        ]
+        models = list(models or available)
+        for key in models:
+            missing = [name for name in FEATURES[key] if not _column_for(name, header)]
+            if missing:
+                raise ValueError(f"{input_path} has no column for {key} features: {', '.join(missing)}")
+        if not models:
+            raise ValueError(f"{input_path} has the feature columns of neither model")
+
+        for sub in ("shards", "out", "leases", "failed"):
+            os.makedirs(_path(job_dir, sub), exist_ok=True)
+
+        shards, first_row = [], 0
+        while True:
+            rows = [row for _, row in zip(range(shard_rows), reader)]
+            if not rows:
+                break
+            shard_id = f"{len(shards):05d}"
+
+            def write(out, rows=rows):
+                writer = csv.writer(out)
+                writer.writerow(header)
+                writer.writerows(rows)
+
+            _write_atomic(shard_input(job_dir, shard_id), write)
+            shards.append({"id": shard_id, "first_row": first_row, "rows": len(rows)})
+            first_row += len(rows)
+
+    manifest = {
+        "input": os.path.abspath(input_path),
+        "header": header,
+        "models": models,
+        "version": version or discover_versions()[-1],
+        "explain": explain,
+        "shard_rows": shard_rows,
+        "total_rows": first_row,
+        "shards": shards,
+        "created": time.time(),
+    }
+    # Written last: a job directory without a manifest is an unfinished plan.
+    _write_atomic(manifest_file, lambda f: json.dump(manifest, f, indent=2))
+    return manifest
+
+
+# ---------------- Leases ----------------
+class Lease:
+    """Exclusive claim on one shard, kept alive by a heartbeat thread."""
+
+    def __init__(self, path, owner, lease_seconds):
+        self.path = path
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            if not self._steal_if_stale():
+                return False
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                return False  # another worker re-claimed it first
+        with os.fdopen(fd, "w") as f:
+            json.dump({"owner": self.owner, "claimed_at": time.time()}, f)
+        self._thread = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+        return True
+
+    def _steal_if_stale(self):
+        try:
+            age = time.time() - os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return True  # released in the meantime
+        if age <= self.lease_seconds:
+            return False
+        # Rename is atomic: of several workers stealing at once, one succeeds.
+        expired = f"{self.path}.expired-{self.owner}"
+        try:
+            os.rename(self.path, expired)
+        except FileNotFoundError:
+            return False
+        os.remove(expired)
+        return True
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                self.lost = True  # taken over; our output is still valid if we finish
+                return
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if not self.lost:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+# ---------------- Scoring ----------------
+def _columns(data, header, features):
+    # Feature name -> column of raw strings; validate_and_encode parses them.
+    index = {name: header.index(_column_for(name, header)) for name in features}
+    return {name: data[:, j] for name, j in index.items()}
+
+
+def score_rows(bundle, key, header, rows, mode=None):
+    """Score and explain raw CSV rows with one model; returns (columns, values per row)."""
+    features = FEATURES[key]
+    model = bundle.models[key]
+    data = np.array(rows, dtype=str).reshape(len(rows), len(header))
+    checked = validate_and_encode(SCHEMAS[key], _columns(data, header, features))
+    classes = bundle.backends[key].classes_
+    class_names = [format_risk_label(c) for c in classes]
+
+    columns = (
+        [f"{key}_label", f"{key}_confidence"]
+        + [f"{key}_p_{name}" for name in class_names]
+        + [f"{key}_top_factors"]
+        + [f"{key}_shap_{name}" for name in features]
+        + [f"{key}_error"]
+    )
+    out = [[""] * len(columns) for _ in rows]
+
+    valid = np.flatnonzero(checked.valid)
+    if len(valid):
+        pred, proba, shap_matrix = score_batch(
+            model, checked.X[valid], bundle.explainers[key], bundle.backends[key], mode
+        )
+        top = np.argsort(-np.abs(shap_matrix), axis=1)[:, :3]
+        for n, i in enumerate(valid):
+            factors = ";".join(f"{features[j]}:{shap_matrix[n, j]:+.4f}" for j in top[n])
+            out[i][: len(columns) - 1] = (
+                [class_names[pred[n]], f"{proba[n, pred[n]]:.6f}"]
+                + [f"{p:.6f}" for p in proba[n]]
+                + [factors]
+                + [f"{v:.6f}" for v in shap_matrix[n]]
+            )
+    for i, messages in checked.row_errors().items():
+        out[i][-1] = "; ".join(messages)
+    return columns, out
+
+
+def score_shard(bundle, manifest, job_dir, shard):
+    with open(shard_input(job_dir, shard["id"]), newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+
+    columns = ["row"] + header
+    values = [[shard["first_row"] + i] + row for i, row in enumerate(rows)]
+    if rows:
+        for key in manifest["models"]:
+            model_columns, model_values = score_rows(bundle, key, header, rows, manifest.get("explain"))
+            columns += model_columns
+            for row, extra in zip(values, model_values):
+                row.extend(extra)
+
+    def write(out):
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        writer.writerows(values)
+
+    _write_atomic(shard_output(job_dir, shard["id"]), write)
+    return len(rows)
+
+
+# ---------------- Work ----------------
+def run_worker(job_dir, worker_id=None, lease_seconds=LEASE_SECONDS, retry_failed=False, bundle=None, nthread=1):
+    """Claim and score shards until every shard is done (or failed); returns a summary."""
+    manifest = read_manifest(job_dir)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    if bundle is None:
+        bundle = load_bundle(manifest["version"], nthread=nthread, warm=False)
+    summary = {"worker": worker_id, "shards": 0, "rows": 0, "failed": 0, "seconds": 0.0}
+    start = time.perf_counter()
+    poll = min(5.0, lease_seconds / 4)
+
+    while True:
+        pending = [
+            s for s in manifest["shards"]
+            if not os.path.exists(shard_output(job_dir, s["id"]))
+            and (retry_failed or not os.path.exists(failed_path(job_dir, s["id"])))
+        ]
+        if not pending:
+            break
+        claimed = False
+        for shard in pending:
+            lease = Lease(lease_path(job_dir, shard["id"]), worker_id, lease_seconds)
+            if not lease.acquire():
+                continue
+            claimed = True
+            try:
+                # Re-check under the lease: another worker may have just finished it.
+                if not os.path.exists(shard_output(job_dir, shard["id"])):
+                    summary["rows"] += score_shard(bundle, manifest, job_dir, shard)
+                    summary["shards"] += 1
+                    if os.path.exists(failed_path(job_dir, shard["id"])):
+                        os.remove(failed_path(job_dir, shard["id"]))
+            except Exception as exc:
+                summary["failed"] += 1
+                record = {"worker": worker_id, "error": repr(exc), "at": time.time()}
+                _write_atomic(failed_path(job_dir, shard["id"]), lambda f: json.dump(record, f))
+            finally:
+                lease.release()
+        if not claimed:
+            # Everything left is leased by live workers; wait for them to
+            # finish or for a lease to expire.
+            time.sleep(poll)
+        retry_failed = False  # one retry pass per run
+
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def _worker_process(job_dir, index, lease_seconds, retry_failed, bundle, nthread, results):
+    set_model_nthread(bundle.models["ds2"], nthread)
+    set_model_nthread(bundle.models["ds3"], nthread)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    results.put(run_worker(job_dir, worker_id, lease_seconds, retry_failed, bundle))
+
+
+def work(job_dir, processes=1, lease_seconds=LEASE_SECONDS, retry_failed=False, nthread=None):
+    manifest = read_manifest(job_dir)
+    nthread = worker_nthread(processes, nthread)
+    # Loaded once; forked workers share it copy-on-write (see prefork_pool.py).
+    bundle = load_bundle(manifest["version"], nthread=nthread, warm=False)
+    if processes <= 1:
+        return [run_worker(job_dir, None, lease_seconds, retry_failed, bundle)]
+    ctx = mp.get_context("fork")
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(
+            target=_worker_process,
+            args=(job_dir, i, lease_seconds, retry_failed, bundle, nthread, results),
+        )
+        for i in range(processes)
+    ]
+    for p in procs:
+        p.start()
+    # Join before collecting: a worker that crashed never reports, and its
+    # shards are picked up by the others once its lease expires.
+    for p in procs:
+        p.join()
+    summaries = []
+    while not results.empty():
+        summaries.append(results.get())
+    for p in procs:
+        if p.exitcode != 0:
+            summaries.append({"worker": f"pid {p.pid}", "shards": 0, "rows": 0, "failed": 0, "seconds": 0.0,
+                              "exitcode": p.exitcode})
+    return summaries
+
+
+# ---------------- Status and merge ----------------
+def status(job_dir, lease_seconds=LEASE_SECONDS):
+    manifest = read_manifest(job_dir)
+    counts = {"done": 0, "leased": 0, "stale": 0, "failed": 0, "pending": 0}
+    rows_done = 0
+    now = time.time()
+    for shard in manifest["shards"]:
+        sid = shard["id"]
+        if os.path.exists(shard_output(job_dir, sid)):
+            counts["done"] += 1
+            rows_done += shard["rows"]
+        elif os.path.exists(lease_path(job_dir, sid)):
+            try:
+                age = now - os.stat(lease_path(job_dir, sid)).st_mtime
+            except FileNotFoundError:
+                age = 0.0
+            counts["stale" if age > lease_seconds else "leased"] += 1
+        elif os.path.exists(failed_path(job_dir, sid)):
+            counts["failed"] += 1
+        else:
+            counts["pending"] += 1
+    return {
+        "shards": len(manifest["shards"]),
+        "rows": manifest["total_rows"],
+        "rows_done": rows_done,
+        "version": manifest["version"],
+        "models": manifest["models"],
+        **counts,
+    }
+
+
+def merge(job_dir, output_path):
+    manifest = read_manifest(job_dir)
+    missing = [s["id"] for s in manifest["shards"] if not os.path.exists(shard_output(job_dir, s["id"]))]
+    if missing:
+        raise ValueError(f"{len(missing)} shards are not done yet (first: {missing[0]})")
+
+    def write(out):
+        for n, shard in enumerate(manifest["shards"]):
+            with open(shard_output(job_dir, shard["id"]), newline="") as f:
+                header = f.readline()
+                if n == 0:
+                    out.write(header)
+                for line in f:
+                    out.write(line)
+
+    _write_atomic(output_path, write)
+    return manifest["total_rows"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    p_plan = sub.add_parser("plan", help="split an input CSV into shards and write the manifest")
+    p_plan.add_argument("input")
+    p_plan.add_argument("--job", required=True, help="job directory (on a filesystem all workers share)")
+    p_plan.add_argument("--shard-rows", type=int, default=5000)
+    p_plan.add_argument("--models", default=None, help="comma-separated, e.g. ds2,ds3 (default: all that fit)")
+    p_plan.add_argument("--version", default=None, help="model version (default: newest)")
+    p_plan.add_argument("--explain", choices=EXPLAIN_MODES, default=EXPLAIN_MODE, help="explanation mode")
+
+    p_work = sub.add_parser("work", help="claim and score shards until the job is done")
+    p_work.add_argument("job")
+    p_work.add_argument("--processes", type=int, default=1, help="local worker processes")
+    p_work.add_argument("--nthread", type=int, default=None, help="XGBoost threads per process")
+    p_work.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS)
+    p_work.add_argument("--retry-failed", action="store_true", help="retry shards recorded as failed")
+
+    p_status = sub.add_parser("status", help="count done, leased, failed and pending shards")
+    p_status.add_argument("job")
+    p_status.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS)
+
+    p_merge = sub.add_parser("merge", help="concatenate the shard outputs in input order")
+    p_merge.add_argument("job")
+    p_merge.add_argument("output")
+
+    args = parser.parse_args()
+    if args.mode == "plan":
+        models = [m for m in args.models.split(",") if m.strip()] if args.models else None
+        m = plan(args.input, args.job, args.shard_rows, models, args.version, args.explain)
+        print(
+            f"{m['total_rows']} rows in {len(m['shards'])} shards; models {', '.join(m['models'])}, "
+            f"version {m['version']}, {m['explain']} explanations"
+        )
+    elif args.mode == "work":
+        for s in work(args.job, args.processes, args.lease_seconds, args.retry_failed, args.nthread):
+            if "exitcode" in s:
+                print(f"{s['worker']}: exited with code {s['exitcode']}")
+                continue
+            rate = s["rows"] / s["seconds"] if s["seconds"] else 0.0
+            print(f"{s['worker']}: {s['shards']} shards, {s['rows']} rows ({rate:.0f} rows/s), {s['failed']} failed")
+    elif args.mode == "status":
+        print(json.dumps(status(args.job, args.lease_seconds), indent=2))
+    else:
+        print(f"Wrote {merge(args.job, args.output)} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+import numpy as np
+
+from utils import (
+    EXPLAIN_MODE,
+    FEATURES_DS2,
+    FEATURES_DS3,
+    get_shap_values,
+    plot_shap_bar,
+    plot_shap_waterfall,
+    create_combined_pdf_report,
+    format_risk_label,
+    feature_widget,
+    plot_png,
+)
+from audit_log import get_audit_logger
+from drift_monitor import get_drift_monitor
+from feature_schema import SCHEMA_DS2, SCHEMA_DS3, spec_map, encode_record
+from model_registry import get_registry
+from memory_guard import current_session_id, get_memory_guard, render_cached_result
+from admission import run_or_defer
+
+SPECS_DS2 = spec_map(SCHEMA_DS2)
+SPECS_DS3 = spec_map(SCHEMA_DS3)
+
+# Both models measure diastolic BP; the form asks once and fills both.
+SHARED_FIELDS = {"Diastolic": "Diastolic_BP"}  # ds3 name -> ds2 name
+
+MODEL_NAMES = {"ds2": "Pregnancy / Antenatal Model", "ds3": "General Maternal Model"}
+FEATURES = {"ds2": FEATURES_DS2, "ds3": FEATURES_DS3}
+
+# Two models per request; shared by all sessions of this process.
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="combined-assess")
+
+
+def risk_color(label: str):
+    label = label.lower()
+    if "low" in label:
+        return "#2ECC71"   # green
+    if "high" in label:
+        return "#E74C3C"   # red
+    return "#F5B041"       # moderate (orange)
+
+
+def risk_rank(label: str):
+    label = label.lower()
+    if "high" in label:
+        return 2
+    if "low" in label:
+        return 0
+    return 1
+
+
+def assess(bundle, key, x):
+    # Predict + SHAP for one model. Runs on a pool thread: XGBoost and the
+    # TreeSHAP kernel spend their time in native code.
+    start = time.perf_counter()
+    backend = bundle.backends[key]
+    row_key = tuple(x[0].tolist())
+    proba = bundle.cached((key, "predict", row_key), lambda: backend.predict_proba(x)[0])
+    pred = int(np.argmax(proba))
+    classes = backend.classes_
+    shap_values, base_value = bundle.cached(
+        (key, "shap", row_key),
+        lambda: get_shap_values(
+            bundle.models[key],
+            x,
+            predicted_class_index=pred if classes is not None else None,
+            explainer=bundle.explainers[key],
+        ),
+    )
+    raw_label = classes[pred] if classes is not None else pred
+    return {
+        "pred": pred,
+        "proba": proba,
+        "classes": classes,
+        "label": format_risk_label(raw_label),
+        "shap_values": shap_values,
+        "base_value": base_value,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def assess_both(bundle, x_by_model):
+    # Submit both models at once; total latency ~ the slower of the two.
+    start = time.perf_counter()
+    futures = {key: _executor.submit(assess, bundle, key, x) for key, x in x_by_model.items()}
+    results = {key: f.result() for key, f in futures.items()}
+    return results, time.perf_counter() - start
+
+
+def render_explanation(bundle, results, inputs, x_by_model, overall):
+
+    # ---------------- XAI (SHAP) ----------------
+    st.markdown("### 🧠 Why did the models say this?")
+    st.markdown(
+        "<p class='section-caption'>Bars pushing to the right increase the estimated risk; bars to the left reduce it.</p>",
+        unsafe_allow_html=True,
+    )
+    if EXPLAIN_MODE == "approx":
+        st.caption("Approximate explanation mode: the feature ranking can differ from exact SHAP.")
+
+    assessments = []
+    pngs = {}
+    tabs = st.tabs([MODEL_NAMES["ds3"], MODEL_NAMES["ds2"]])
+    for tab, key in zip(tabs, ("ds3", "ds2")):
+        r = results[key]
+        features = FEATURES[key]
+        shap_values = r["shap_values"]
+        with tab:
+            col_bar, col_waterfall = st.columns(2)
+            with col_bar:
+                pngs[key, "bar"] = plot_png(plot_shap_bar, shap_values, features, "Feature impact on prediction")
+                st.image(pngs[key, "bar"], use_container_width=True)
+            with col_waterfall:
+                pngs[key, "waterfall"] = plot_png(
+                    plot_shap_waterfall,
+                    shap_values,
+                    r["base_value"],
+                    x_by_model[key][0],
+                    features,
+                    "How each feature shifts risk",
+                )
+                st.image(pngs[key, "waterfall"], use_container_width=True)
+
+            idx_sorted = np.argsort(np.abs(shap_values))[::-1]
+            st.write("**Top contributing factors:**")
+            for i in idx_sorted[:3]:
+                direction = "raised the risk" if shap_values[i] > 0 else "lowered the risk"
+                st.write(f"- **{features[i]}** → {direction}")
+
+        classes = r["classes"]
+        assessments.append(
+            {
+                "model_name": MODEL_NAMES[key],
+                "input_dict": inputs[key],
+                "pred_label": r["label"],
+                "proba_dict": (
+                    {str(c): float(p) for c, p in zip(classes, r["proba"])} if classes is not None else None
+                ),
+                "shap_contribs": [(features[i], float(shap_values[i])) for i in idx_sorted[:5]],
+                "model_version": bundle.version,
+            }
+        )
+
+    # ---------------- PDF ----------------
+    st.markdown("### 📄 Download report")
+    pdf_buffer = create_combined_pdf_report(assessments)
+    # The cached view shows the General model's charts; the PDF covers both.
+    get_memory_guard().put(
+        current_session_id(),
+        "combined",
+        {
+            "label": overall,
+            "bar_png": pngs["ds3", "bar"],
+            "waterfall_png": pngs["ds3", "waterfall"],
+            "pdf": pdf_buffer.getvalue(),
+            "shap_values": {key: r["shap_values"] for key, r in results.items()},
+        },
+    )
+    st.download_button(
+        label="⬇️ Download PDF Report",
+        data=pdf_buffer,
+        file_name="maternal_risk_report_combined.pdf",
+        mime="application/pdf",
+        use_container_width=True,
+    )
+
+
+def render_combined_model():
+    bundle = get_registry().active()
+
+    st.header("🤰 Combined Antenatal Assessment")
+    st.markdown(
+        "<p class='section-caption'>Enter the visit and history data once; both models score the patient at the same time.</p>",
+        unsafe_allow_html=True,
+    )
+    st.markdown("#### Enter patient information")
+
+    # ---------------- INPUT COLUMNS ----------------
+    col_left, col_mid, col_right = st.columns([1.1, 1.1, 1.0])
+
+    values_ds2, values_ds3 = {}, {}
+    with col_left:
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown("##### Vitals", unsafe_allow_html=False)
+        age = feature_widget(SPECS_DS3["Age"], key="combined_age")
+        values_ds2["Age"] = values_ds3["Age"] = age
+        values_ds2["Systolic_BP"] = feature_widget(SPECS_DS2["Systolic_BP"], key="combined_systolic")
+        diastolic = feature_widget(SPECS_DS3["Diastolic"], key="combined_diastolic")
+        values_ds3["Diastolic"] = values_ds2[SHARED_FIELDS["Diastolic"]] = diastolic
+        for name in ["BS", "BMI", "Heart Rate"]:
+            values_ds3[name] = feature_widget(SPECS_DS3[name], key=f"combined_{name}")
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    with col_mid:
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown("##### Pregnancy details", unsafe_allow_html=False)
+        for name in ["TT_Doses", "Gestational_Age", "Weight"]:
+            values_ds2[name] = feature_widget(SPECS_DS2[name], key=f"combined_{name}")
+        st.markdown("##### Infection screening", unsafe_allow_html=False)
+        for name in ["VDRL", "HBsAg"]:
+            values_ds2[name] = feature_widget(SPECS_DS2[name], key=f"combined_{name}")
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    with col_right:
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.markdown("##### Clinical history", unsafe_allow_html=False)
+        for name in ["Previous Complications", "Preexisting Diabetes", "Gestational Diabetes", "Mental Health"]:
+            values_ds3[name] = feature_widget(SPECS_DS3[name], key=f"combined_{name}")
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    # ---------------- ACTION BUTTONS ----------------
+    st.markdown("")
+    col_btn1, col_btn2 = st.columns(2)
+    with col_btn1:
+        predict_clicked = st.button("🔮 Predict & Explain", key="predict_combined", use_container_width=True)
+    with col_btn2:
+        home_clicked = st.button("🏠 Back to Home", key="home_combined", use_container_width=True)
+
+    if home_clicked:
+        st.session_state["page"] = "Home"
+        return
+    if not predict_clicked:
+        render_cached_result("combined", "maternal_risk_report_combined.pdf")
+        return
+
+    # ---------------- PREPARE INPUTS ----------------
+    try:
+        inputs = {
+            "ds2": encode_record(SCHEMA_DS2, values_ds2),
+            "ds3": encode_record(SCHEMA_DS3, values_ds3),
+        }
+    except ValueError as exc:
+        st.error(f"Please check the inputs: {exc}")
+        return
+    x_by_model = {
+        key: np.array([[inputs[key][f] for f in FEATURES[key]]], dtype=float) for key in inputs
+    }
+
+    # ---------------- PREDICTION + SHAP (concurrent) ----------------
+    results, total_seconds = assess_both(bundle, x_by_model)
+
+    for key, r in results.items():
+        get_audit_logger().log(
+            model_name=MODEL_NAMES[key],
+            input_dict=inputs[key],
+            pred_label=r["label"],
+            confidence=float(r["proba"][r["pred"]]),
+            model_version=bundle.version,
+        )
+        get_drift_monitor().observe(key, x_by_model[key][0], r["pred"])
+
+    # ---------------- MERGED RESULT VIEW ----------------
+    st.markdown("### 🧾 Prediction")
+    overall = max((r["label"] for r in results.values()), key=risk_rank)
+
+    st.markdown("<div class='result-card'>", unsafe_allow_html=True)
+    col_r0, col_r1, col_r2 = st.columns([1.2, 1.2, 1.2])
+
+    with col_r0:
+        badge = "risk-high" if risk_rank(overall) == 2 else ("risk-low" if risk_rank(overall) == 0 else "risk-moderate")
+        st.markdown("<div class='result-title'>Overall (highest of both models)</div>", unsafe_allow_html=True)
+        st.markdown(
+            f"""
+            <span class="risk-badge {badge}">{overall}</span>
+            <div class="risk-main-value" style="color:{risk_color(overall)}; margin-top:0.6rem;">
+                {overall}
+            </div>
+            <div class="risk-subtext">
+                The more cautious of the two model assessments.
+            </div>
+            """,
+            unsafe_allow_html=True,
+        )
+
+    for col, key in ((col_r1, "ds3"), (col_r2, "ds2")):
+        r = results[key]
+        with col:
+            conf = float(r["proba"][r["pred"]])
+            st.markdown(f"**{MODEL_NAMES[key]}**")
+            st.markdown(
+                f"<span style='color:{risk_color(r['label'])}; font-weight:700;'>{r['label']}</span>",
+                unsafe_allow_html=True,
+            )
+            st.markdown(f"Model confidence: **{conf*100:.1f}%**")
+            st.progress(conf)
+
+    st.markdown("</div>", unsafe_allow_html=True)
+
+    sequential = sum(r["seconds"] for r in results.values())
+    st.caption(
+        f"Both models scored and explained in {total_seconds*1000:.0f} ms "
+        f"(one after the other: {sequential*1000:.0f} ms). Model version: {bundle.version}."
+    )
+
+    # ---------------- EXPLANATION (admission-controlled) ----------------
+    run_or_defer(lambda: render_explanation(bundle, results, inputs, x_by_model, overall), key="combined")
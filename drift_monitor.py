@@ -0,0 +1,467 @@
+# drift_monitor.py
+"""Streaming input-drift monitor with fixed-size sketches.
+
+Every prediction updates one histogram per input feature and a count per
+predicted class. Numeric features get up to MRP_DRIFT_BINS bins, with edges
+at the reference profile's quantiles (equal-width over the schema range
+without a reference); choice features get one bin per choice. An update is a
+handful of integer increments, and memory does not grow with traffic. No
+inputs are stored.
+
+The sketches are compared with a reference profile (MRP_DRIFT_REFERENCE,
+default drift_reference.json) built from training or known-good data:
+
+    python drift_monitor.py build-reference --csv training.csv
+    python drift_monitor.py build-reference --audit-log --limit 5000
+
+Scores are computed per window of MRP_DRIFT_WINDOW predictions. Until the
+first window fills, the partial window is used once it has
+MRP_DRIFT_MIN_COUNT rows. After that, the last complete window is used.
+
+    PSI          population stability index; >= 0.1 warn, >= 0.25 alert
+    KS           max gap between binned CDFs (numeric features); alert when
+                 above the 0.1% critical value for the two sample sizes
+    TVD          total variation distance (choice features, predicted class)
+
+Alerts are shown in the sidebar. With MRP_DRIFT_METRICS_FILE set, scores are
+also written in Prometheus text format each time a window completes, e.g.
+for the node_exporter textfile collector.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_right
+
+import numpy as np
+
+from feature_schema import SCHEMAS, validate_and_encode
+
+logger = logging.getLogger(__name__)
+
+DRIFT_BINS = int(os.environ.get("MRP_DRIFT_BINS", "10"))
+DRIFT_WINDOW = int(os.environ.get("MRP_DRIFT_WINDOW", "500"))
+DRIFT_MIN_COUNT = int(os.environ.get("MRP_DRIFT_MIN_COUNT", "100"))
+DRIFT_REFERENCE = os.environ.get("MRP_DRIFT_REFERENCE", "drift_reference.json")
+DRIFT_METRICS_FILE = os.environ.get("MRP_DRIFT_METRICS_FILE")
+PSI_WARN, PSI_ALERT = 0.1, 0.25
+KS_ALPHA_COEF = 1.949  # two-sample KS critical value coefficient at alpha = 0.001
+MAX_CLASSES = 8
+_EPS = 1e-4
+
+
+# ---------------- Sketches ----------------
+class ModelSketch:
+    """Fixed-bin histograms for one model's features plus predicted-class counts.
+
+    `edges` maps numeric features to their interior bin edges (from reference
+    quantiles); without it the schema range is split into `bins` equal bins.
+    """
+
+    def __init__(self, schema, bins=DRIFT_BINS, edges=None):
+        self.schema = schema
+        self.edges = []
+        for spec in schema:
+            if spec.is_choice:
+                self.edges.append(None)
+            elif edges and spec.name in edges:
+                self.edges.append([float(e) for e in edges[spec.name]])
+            else:
+                self.edges.append(np.linspace(spec.min_value, spec.max_value, bins + 1)[1:-1].tolist())
+        self.n_bins = [len(spec.choices) if e is None else len(e) + 1 for spec, e in zip(schema, self.edges)]
+        self.counts = np.zeros((len(schema), max(self.n_bins)), dtype=np.int64)
+        self.class_counts = np.zeros(MAX_CLASSES, dtype=np.int64)
+        self.n = 0
+
+    def observe(self, x_row, pred):
+        counts = self.counts
+        for j, (value, edges) in enumerate(zip(x_row, self.edges)):
+            if edges is None:
+                counts[j, min(max(int(value), 0), self.n_bins[j] - 1)] += 1
+            else:
+                counts[j, bisect_right(edges, value)] += 1
+        self.class_counts[min(int(pred), MAX_CLASSES - 1)] += 1
+        self.n += 1
+
+    def observe_many(self, X, pred):
+        # Bulk update, for building references.
+        for j, edges in enumerate(self.edges):
+            if edges is None:
+                idx = np.clip(X[:, j].astype(np.intp), 0, self.n_bins[j] - 1)
+            else:
+                idx = np.searchsorted(edges, X[:, j], side="right")
+            self.counts[j] += np.bincount(idx, minlength=self.counts.shape[1])
+        self.class_counts += np.bincount(np.minimum(pred, MAX_CLASSES - 1), minlength=MAX_CLASSES)
+        self.n += len(X)
+
+    def reset(self):
+        self.counts[:] = 0
+        self.class_counts[:] = 0
+        self.n = 0
+
+    def copy(self):
+        other = ModelSketch.__new__(ModelSketch)
+        other.__dict__.update(self.__dict__)
+        other.counts = self.counts.copy()
+        other.class_counts = self.class_counts.copy()
+        return other
+
+    def histogram(self, j):
+        return self.counts[j, : self.n_bins[j]]
+
+    def to_dict(self):
+        return {
+            "n": int(self.n),
+            "edges": {s.name: e for s, e in zip(self.schema, self.edges) if e is not None},
+            "features": {s.name: self.histogram(j).tolist() for j, s in enumerate(self.schema)},
+            "classes": self.class_counts.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, schema, data, bins=DRIFT_BINS):
+        sketch = cls(schema, bins, data.get("edges"))
+        for j, s in enumerate(schema):
+            counts = data["features"][s.name]
+            if len(counts) != sketch.n_bins[j]:
+                raise ValueError(f"reference for '{s.name}' has {len(counts)} bins, expected {sketch.n_bins[j]}")
+            sketch.counts[j, : len(counts)] = counts
+        sketch.class_counts[: len(data["classes"])] = data["classes"][:MAX_CLASSES]
+        sketch.n = int(data["n"])
+        return sketch
+
+
+def quantile_edges(X, schema, bins=DRIFT_BINS):
+    # Interior edges at the reference quantiles, so each bin holds about the
+    # same share of reference rows (fewer bins for features with few values).
+    qs = np.linspace(0, 1, bins + 1)[1:-1]
+    return {
+        spec.name: np.unique(np.quantile(X[:, j], qs)).tolist()
+        for j, spec in enumerate(schema)
+        if not spec.is_choice and len(X)
+    }
+
+
+# ---------------- Scores ----------------
+def psi(expected, actual):
+    p = np.asarray(expected, dtype=float)
+    q = np.asarray(actual, dtype=float)
+    p = np.maximum(p / max(p.sum(), 1), _EPS)
+    q = np.maximum(q / max(q.sum(), 1), _EPS)
+    return float(np.sum((q - p) * np.log(q / p)))
+
+
+def ks(expected, actual):
+    p = np.cumsum(expected) / max(np.sum(expected), 1)
+    q = np.cumsum(actual) / max(np.sum(actual), 1)
+    return float(np.max(np.abs(p - q)))
+
+
+def tvd(expected, actual):
+    p = np.asarray(expected, dtype=float) / max(np.sum(expected), 1)
+    q = np.asarray(actual, dtype=float) / max(np.sum(actual), 1)
+    return float(0.5 * np.abs(p - q).sum())
+
+
+def ks_critical(n, m):
+    return KS_ALPHA_COEF * np.sqrt((n + m) / (n * m)) if n and m else float("inf")
+
+
+def compare(reference, current):
+    """Per-feature (and predicted-class) drift scores of `current` vs `reference`."""
+    rows = []
+    critical = ks_critical(reference.n, current.n)
+    for j, spec in enumerate(reference.schema):
+        ref, cur = reference.histogram(j), current.histogram(j)
+        score = psi(ref, cur)
+        row = {"feature": spec.name, "psi": score}
+        if spec.is_choice:
+            row["tvd"] = tvd(ref, cur)
+            drifted_by_shape = False
+        else:
+            row["ks"] = ks(ref, cur)
+            drifted_by_shape = row["ks"] > critical
+        row["status"] = "alert" if score >= PSI_ALERT or drifted_by_shape else ("warn" if score >= PSI_WARN else "ok")
+        rows.append(row)
+    score = psi(reference.class_counts, current.class_counts)
+    rows.append(
+        {
+            "feature": "predicted class",
+            "psi": score,
+            "tvd": tvd(reference.class_counts, current.class_counts),
+            "status": "alert" if score >= PSI_ALERT else ("warn" if score >= PSI_WARN else "ok"),
+        }
+    )
+    return rows
+
+
+# ---------------- Monitor ----------------
+class DriftMonitor:
+    def __init__(self, reference=None, window=DRIFT_WINDOW, min_count=DRIFT_MIN_COUNT, bins=DRIFT_BINS,
+                 metrics_file=DRIFT_METRICS_FILE):
+        self.reference = reference or {}  # key -> ModelSketch
+        self.window = max(1, int(window))
+        self.min_count = min_count
+        self.metrics_file = metrics_file
+        # Live sketches share the reference's bin edges.
+        self._current = {
+            key: ModelSketch(schema, bins, self.reference[key].to_dict()["edges"] if key in self.reference else None)
+            for key, schema in SCHEMAS.items()
+        }
+        self._last = {}  # key -> last complete window
+        self.total = {key: 0 for key in SCHEMAS}
+        self.windows = {key: 0 for key in SCHEMAS}
+        self._alerting = set()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # one metrics file writer at a time
+
+    def observe(self, key, x_row, pred):
+        with self._lock:
+            current = self._current[key]
+            current.observe(x_row, pred)
+            self.total[key] += 1
+            if current.n < self.window:
+                return
+            self._last[key] = current.copy()
+            current.reset()
+            self.windows[key] += 1
+        self._on_window(key)
+
+    def _sample(self, key):
+        current = self._current[key]
+        if key in self._last:
+            return self._last[key]
+        return current.copy() if current.n >= self.min_count else None
+
+    def scores(self, key):
+        """Drift rows for one model, or None without a reference or enough data."""
+        with self._lock:
+            sample = self._sample(key)
+        if key not in self.reference or sample is None:
+            return None
+        return compare(self.reference[key], sample)
+
+    def alerts(self):
+        out = {}
+        for key in SCHEMAS:
+            rows = self.scores(key) or []
+            drifted = [r["feature"] for r in rows if r["status"] == "alert"]
+            if drifted:
+                out[key] = drifted
+        return out
+
+    def _on_window(self, key):
+        drifted = set(self.alerts().get(key, []))
+        with self._lock:
+            new = {(key, f) for f in drifted} - self._alerting
+            self._alerting = {a for a in self._alerting if a[0] != key} | {(key, f) for f in drifted}
+        if new:
+            logger.warning("Input drift for %s: %s", key, ", ".join(sorted(f for _, f in new)))
+        if self.metrics_file:
+            self.write_metrics(self.metrics_file)
+
+    def metrics_text(self):
+        lines = [
+            "# HELP mrp_drift_psi Population stability index vs the reference profile.",
+            "# TYPE mrp_drift_psi gauge",
+        ]
+        ks_lines, alert_lines = [], []
+        for key in SCHEMAS:
+            for r in self.scores(key) or []:
+                labels = f'model="{key}",feature="{r["feature"]}"'
+                lines.append(f"mrp_drift_psi{{{labels}}} {r['psi']:.6f}")
+                if "ks" in r:
+                    ks_lines.append(f"mrp_drift_ks{{{labels}}} {r['ks']:.6f}")
+                alert_lines.append(f"mrp_drift_alert{{{labels}}} {int(r['status'] == 'alert')}")
+        lines += ["# HELP mrp_drift_ks Max gap between binned CDFs.", "# TYPE mrp_drift_ks gauge"] + ks_lines
+        lines += ["# HELP mrp_drift_alert 1 when the feature has drifted.", "# TYPE mrp_drift_alert gauge"]
+        lines += alert_lines
+        lines += ["# HELP mrp_drift_observed_total Predictions observed.", "# TYPE mrp_drift_observed_total counter"]
+        lines += [f'mrp_drift_observed_total{{model="{key}"}} {n}' for key, n in self.total.items()]
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self, path):
+        # Windows of both models can complete at once in different sessions;
+        # the pid alone does not make the temp file private to one writer.
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._write_lock:
+            try:
+                with open(tmp, "w") as f:
+                    f.write(self.metrics_text())
+                os.replace(tmp, path)
+            except OSError:
+                logger.exception("Could not write drift metrics to %s", path)
+
+
+# ---------------- Reference profile ----------------
+def load_reference(path=DRIFT_REFERENCE, bins=DRIFT_BINS):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    return {key: ModelSketch.from_dict(SCHEMAS[key], data["models"][key], bins) for key in data["models"]}
+
+
+def build_reference(X_by_model, bundle, bins=DRIFT_BINS):
+    """Reference sketches from encoded rows, with predicted classes from `bundle`."""
+    reference = {}
+    for key, X in X_by_model.items():
+        X = X[~np.isnan(X).any(axis=1)]
+        sketch = ModelSketch(SCHEMAS[key], bins, quantile_edges(X, SCHEMAS[key], bins))
+        if len(X):
+            pred = np.argmax(bundle.backends[key].predict_proba(X), axis=1)
+            sketch.observe_many(X, pred)
+        reference[key] = sketch
+    return reference
+
+
+def save_reference(reference, path=DRIFT_REFERENCE, source=None, version=None):
+    data = {
+        "created": time.time(),
+        "source": source,
+        "model_version": version,
+        "bins": DRIFT_BINS,
+        "models": {key: sketch.to_dict() for key, sketch in reference.items()},
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def rows_from_csv(path):
+    import csv
+
+    from batch_score import ALIASES
+
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+    header = reader.fieldnames or []
+    out = {}
+    for key, schema in SCHEMAS.items():
+        columns = {s.name: s.name if s.name in header else ALIASES.get(s.name) for s in schema}
+        if all(c in header for c in columns.values()):
+            data = {name: np.array([r[c] for r in rows], dtype=str) for name, c in columns.items()}
+            out[key] = validate_and_encode(schema, data).X
+    return out
+
+
+def rows_from_audit_log(db_path=None, limit=None):
+    import sqlite3
+
+    from audit_log import AUDIT_DB_PATH
+
+    names = {"Pregnancy / Antenatal Model": "ds2", "General Maternal Model": "ds3"}
+    query = "SELECT model, inputs FROM predictions ORDER BY id"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    records = {key: [] for key in SCHEMAS}
+    with sqlite3.connect(db_path or AUDIT_DB_PATH) as conn:
+        for model, inputs in conn.execute(query):
+            key = names.get(model)
+            if key is not None:
+                records[key].append(json.loads(inputs))
+    out = {}
+    for key, recs in records.items():
+        if recs:
+            data = {s.name: np.array([r.get(s.name, "") for r in recs], dtype=object) for s in SCHEMAS[key]}
+            out[key] = validate_and_encode(SCHEMAS[key], data).X
+    return out
+
+
+# ---------------- Process-wide instance ----------------
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_drift_monitor():
+    global _monitor
+    if _monitor is None:
+        with _monitor_lock:
+            if _monitor is None:
+                try:
+                    reference = load_reference()
+                except (OSError, KeyError, ValueError):
+                    logger.exception("Could not load drift reference %s", DRIFT_REFERENCE)
+                    reference = {}
+                _monitor = DriftMonitor(reference)
+    return _monitor
+
+
+# ---------------- Streamlit views ----------------
+MODEL_NAMES = {"ds2": "Pregnancy / Antenatal Model", "ds3": "General Maternal Model"}
+
+
+def render_drift_alerts():
+    import streamlit as st
+
+    for key, features in get_drift_monitor().alerts().items():
+        st.sidebar.warning(
+            f"Input drift: recent {MODEL_NAMES[key]} patients differ from the reference data "
+            f"({', '.join(features)})."
+        )
+
+
+def render_drift_status():
+    import streamlit as st
+
+    monitor = get_drift_monitor()
+    if not monitor.reference:
+        st.markdown(
+            f"No reference profile at `{DRIFT_REFERENCE}`. Build one with "
+            "`python drift_monitor.py build-reference`."
+        )
+    for key in SCHEMAS:
+        st.markdown(
+            f"**{MODEL_NAMES[key]}:** {monitor.total[key]} predictions, "
+            f"{monitor.windows[key]} complete windows of {monitor.window}"
+        )
+        rows = monitor.scores(key)
+        if rows is None:
+            continue
+        st.table(
+            [
+                {
+                    "feature": r["feature"],
+                    "PSI": round(r["psi"], 3),
+                    "KS / TVD": round(r.get("ks", r.get("tvd", 0.0)), 3),
+                    "status": r["status"],
+                }
+                for r in rows
+            ]
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="mode", required=True)
+    p_build = sub.add_parser("build-reference", help="write the reference profile")
+    src = p_build.add_mutually_exclusive_group(required=True)
+    src.add_argument("--csv", help="training or known-good data with feature columns")
+    src.add_argument("--audit-log", action="store_true", help="use logged predictions (oldest first)")
+    p_build.add_argument("--limit", type=int, default=None, help="audit log rows to use")
+    p_build.add_argument("--output", default=DRIFT_REFERENCE)
+    p_build.add_argument("--version", default=None, help="model version for predicted classes (default: newest)")
+    args = parser.parse_args()
+
+    from model_registry import discover_versions, load_bundle
+
+    version = args.version or discover_versions()[-1]
+    bundle = load_bundle(version, warm=False)
+    if args.csv:
+        X_by_model, source = rows_from_csv(args.csv), os.path.abspath(args.csv)
+    else:
+        X_by_model, source = rows_from_audit_log(limit=args.limit), "audit log"
+    if not X_by_model:
+        raise SystemExit("No rows with the feature columns of either model.")
+    reference = build_reference(X_by_model, bundle)
+    save_reference(reference, args.output, source, version)
+    for key, sketch in reference.items():
+        print(f"{key}: {sketch.n} rows")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
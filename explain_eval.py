@@ -0,0 +1,139 @@
+# explain_eval.py
+"""Compare the approximate explanation mode with exact TreeSHAP.
+
+    python explain_eval.py                          # 2000 random rows per model
+    python explain_eval.py --rows 10000 --json eval.json
+    python explain_eval.py --input screening.csv    # sample rows from a real file
+
+For each model this reports the speed of both modes, for a whole batch and
+for one row at a time (as a page does). It also reports how well the
+approximate ranking of features by |contribution| agrees with exact SHAP:
+
+    top-k overlap   mean |exact top-k & approx top-k| / k
+    same set        share of rows whose top-k features are the same set
+    same order      share of rows whose top-k features are in the same order
+    sign agreement  share of exact top-3 features whose direction matches
+
+Use it to pick MRP_EXPLAIN_MODE (pages, pre-fork pool) or
+`batch_score.py plan --explain` per workload.
+"""
+import argparse
+import csv
+import json
+import time
+
+import numpy as np
+
+from batch_score import ALIASES
+from feature_schema import SCHEMAS, random_records, validate_and_encode
+from model_registry import discover_versions, load_bundle
+from utils import FEATURES_DS2, FEATURES_DS3, get_shap_values, score_batch
+
+FEATURES = {"ds2": FEATURES_DS2, "ds3": FEATURES_DS3}
+TOP_K = (1, 3, 5)
+
+
+def rank_agreement(exact, approx, ks=TOP_K):
+    """Top-k agreement of two (rows, features) contribution matrices."""
+    order_exact = np.argsort(-np.abs(exact), axis=1, kind="stable")
+    order_approx = np.argsort(-np.abs(approx), axis=1, kind="stable")
+    out = {}
+    for k in ks:
+        k = min(k, exact.shape[1])
+        top_e, top_a = order_exact[:, :k], order_approx[:, :k]
+        overlap = np.array([len(np.intersect1d(e, a)) for e, a in zip(top_e, top_a)]) / k
+        out[f"top{k}_overlap"] = float(overlap.mean())
+        out[f"top{k}_same_set"] = float(np.mean(overlap == 1.0))
+        out[f"top{k}_same_order"] = float(np.mean(np.all(top_e == top_a, axis=1)))
+    top3 = order_exact[:, :3]
+    rows = np.arange(exact.shape[0])[:, None]
+    out["top3_sign_agreement"] = float(np.mean(np.sign(exact[rows, top3]) == np.sign(approx[rows, top3])))
+    return out
+
+
+def _timed(fn, min_seconds=0.3):
+    fn()  # first-call setup
+    calls, start = 0, time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds and calls >= 3:
+            return elapsed / calls
+
+
+def sample_rows(key, n_rows, input_path=None, seed=0):
+    if input_path is None:
+        return random_records(SCHEMAS[key], n_rows, seed)
+    with open(input_path, newline="") as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+    header = reader.fieldnames or []
+    data = {}
+    for name in FEATURES[key]:
+        column = name if name in header else ALIASES.get(name)
+        if column not in header:
+            raise ValueError(f"{input_path} has no column for {key} feature '{name}'")
+        data[name] = np.array([r[column] for r in rows], dtype=str)
+    X = validate_and_encode(SCHEMAS[key], data).X
+    X = X[~np.isnan(X).any(axis=1)]
+    if len(X) > n_rows:
+        X = X[np.random.default_rng(seed).choice(len(X), n_rows, replace=False)]
+    return X
+
+
+def evaluate(bundle, key, x):
+    model, explainer, backend = bundle.models[key], bundle.explainers[key], bundle.backends[key]
+    _, _, exact = score_batch(model, x, explainer, backend, mode="exact")
+    _, _, approx = score_batch(model, x, explainer, backend, mode="approx")
+
+    batch = {m: _timed(lambda m=m: score_batch(model, x, explainer, backend, mode=m)) for m in ("exact", "approx")}
+    row = x[:1]
+    single = {m: _timed(lambda m=m: get_shap_values(model, row, 0, explainer, mode=m)) for m in ("exact", "approx")}
+    return {
+        "model": key,
+        "rows": int(x.shape[0]),
+        "batch_ms_per_row": {m: t * 1000 / x.shape[0] for m, t in batch.items()},
+        "batch_speedup": batch["exact"] / batch["approx"],
+        "single_row_ms": {m: t * 1000 for m, t in single.items()},
+        "single_row_speedup": single["exact"] / single["approx"],
+        "max_abs_diff": float(np.max(np.abs(exact - approx))),
+        **rank_agreement(exact, approx),
+    }
+
+
+def print_report(r):
+    print(f"\n{r['model']}: {r['rows']} rows")
+    b, s = r["batch_ms_per_row"], r["single_row_ms"]
+    print(f"  batch      exact {b['exact']:.4f} ms/row, approx {b['approx']:.4f} ms/row ({r['batch_speedup']:.1f}x)")
+    print(f"  single row exact {s['exact']:.3f} ms, approx {s['approx']:.3f} ms ({r['single_row_speedup']:.1f}x)")
+    for k in TOP_K:
+        if f"top{k}_overlap" in r:
+            print(
+                f"  top-{k}: overlap {r[f'top{k}_overlap']:.3f}, same set {r[f'top{k}_same_set']:.3f}, "
+                f"same order {r[f'top{k}_same_order']:.3f}"
+            )
+    print(f"  top-3 sign agreement {r['top3_sign_agreement']:.3f}, max |diff| {r['max_abs_diff']:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000, help="sample size per model")
+    parser.add_argument("--input", default=None, help="CSV to sample rows from (default: random valid rows)")
+    parser.add_argument("--version", default=None, help="model version (default: newest)")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    bundle = load_bundle(args.version or discover_versions()[-1], warm=False)
+    reports = []
+    for key in ("ds2", "ds3"):
+        r = evaluate(bundle, key, sample_rows(key, args.rows, args.input))
+        print_report(r)
+        reports.append(r)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# feature_schema.py
+"""Declarative input schema for both models.
+
+The page widgets, the pre-fork scoring API and batch jobs all read the valid
+ranges and categorical encodings from here, so they agree on what a valid
+patient record is.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from utils import FEATURES_DS2, FEATURES_DS3
+
+# Error codes reported per cell by validate_and_encode().
+OK = 0
+MISSING = 1        # absent, empty or not a number
+BELOW_MIN = 2
+ABOVE_MAX = 3
+NOT_INTEGER = 4
+UNKNOWN_CHOICE = 5
+
+ERROR_MESSAGES = {
+    MISSING: "missing or not a number",
+    BELOW_MIN: "below minimum",
+    ABOVE_MAX: "above maximum",
+    NOT_INTEGER: "must be a whole number",
+    UNKNOWN_CHOICE: "unknown category",
+}
+
+
+@dataclass(frozen=True)
+class FeatureSpec:
+    name: str               # column name used by the model
+    label: str              # widget label shown in the UI
+    kind: str               # "int", "float" or "choice"
+    min_value: float = 0
+    max_value: float = 1
+    default: object = 0
+    step: float = 1
+    choices: tuple = ()     # for "choice": labels in code order (index == encoded value)
+    target: tuple = ()      # (low, high) normal range of an actionable input; the
+                            # counterfactual search only moves values towards it
+
+    @property
+    def is_choice(self):
+        return self.kind == "choice"
+
+
+def _yes_no(name, label):
+    return FeatureSpec(name, label, "choice", 0, 1, "No", choices=("No", "Yes"))
+
+
+def _neg_pos(name, label):
+    return FeatureSpec(name, label, "choice", 0, 1, "Negative", choices=("Negative", "Positive"))
+
+
+# Targets: normal adult blood pressure, random blood sugar in mg/dL, and the
+# WHO normal BMI band. Weight has none: without height there is no normal
+# range, so it is not suggested as a change.
+
+# ---------------- Pregnancy / Antenatal model ----------------
+SCHEMA_DS2 = [
+    FeatureSpec("Age", "Age (years)", "int", 10, 60, 25, 1),
+    FeatureSpec("TT_Doses", "TT doses received", "int", 0, 5, 2, 1),
+    FeatureSpec("Gestational_Age", "Gestational age (weeks)", "int", 4, 42, 20, 1),
+    FeatureSpec("Weight", "Weight (kg)", "float", 30.0, 150.0, 60.0, 0.5),
+    _neg_pos("VDRL", "VDRL (Syphilis test)"),
+    _neg_pos("HBsAg", "HBsAg (Hepatitis B)"),
+    FeatureSpec("Systolic_BP", "Systolic BP (mmHg)", "int", 70, 220, 110, 1, target=(90, 120)),
+    FeatureSpec("Diastolic_BP", "Diastolic BP (mmHg)", "int", 40, 130, 70, 1, target=(60, 80)),
+]
+
+# ---------------- General maternal model ----------------
+SCHEMA_DS3 = [
+    FeatureSpec("Age", "Age (years)", "int", 10, 60, 25, 1),
+    FeatureSpec("Diastolic", "Diastolic BP (mmHg)", "int", 40, 130, 80, 1, target=(60, 80)),
+    FeatureSpec("BS", "Blood Sugar (BS)", "int", 40, 400, 100, 1, target=(70, 140)),
+    FeatureSpec("BMI", "BMI", "float", 10.0, 60.0, 24.0, 0.1, target=(18.5, 24.9)),
+    _yes_no("Previous Complications", "Previous complications"),
+    _yes_no("Preexisting Diabetes", "Preexisting diabetes"),
+    _yes_no("Gestational Diabetes", "Gestational diabetes"),
+    _yes_no("Mental Health", "Mental health issue"),
+    FeatureSpec("Heart Rate", "Heart rate (bpm)", "int", 40, 200, 80, 1),
+]
+
+# Schemas must stay in training order.
+assert [s.name for s in SCHEMA_DS2] == FEATURES_DS2
+assert [s.name for s in SCHEMA_DS3] == FEATURES_DS3
+
+SCHEMAS = {"ds2": SCHEMA_DS2, "ds3": SCHEMA_DS3}
+
+
+def spec_map(schema):
+    return {s.name: s for s in schema}
+
+
+# ---------------- Vectorized validation / encoding ----------------
+class ValidationResult:
+    """Outcome of validating n rows against a schema.
+
+    X           float64 (n, n_features), encoded model input (NaN where invalid)
+    error_code  int8 (n, n_features), one of the codes above (0 == OK)
+    valid       bool (n,), rows with no errors
+    """
+
+    def __init__(self, schema, X, error_code):
+        self.schema = schema
+        self.X = X
+        self.error_code = error_code
+        self.valid = ~error_code.any(axis=1)
+
+    @property
+    def n_invalid(self):
+        return int((~self.valid).sum())
+
+    def error_counts(self):
+        # {feature: {message: count}} computed with one bincount per feature.
+        out = {}
+        for j, spec in enumerate(self.schema):
+            counts = np.bincount(self.error_code[:, j], minlength=len(ERROR_MESSAGES) + 1)
+            per = {ERROR_MESSAGES[c]: int(counts[c]) for c in ERROR_MESSAGES if counts[c]}
+            if per:
+                out[spec.name] = per
+        return out
+
+    def row_errors(self, limit=None):
+        # Messages for invalid rows only, as {row_index: ["Age: above maximum", ...]}.
+        # Loops run over the (usually few) bad cells, not over every row.
+        rows, cols = np.nonzero(self.error_code)
+        if limit is not None:
+            keep = np.isin(rows, np.unique(rows)[:limit])
+            rows, cols = rows[keep], cols[keep]
+        out = {}
+        for i, j in zip(rows.tolist(), cols.tolist()):
+            msg = f"{self.schema[j].name}: {ERROR_MESSAGES[int(self.error_code[i, j])]}"
+            out.setdefault(i, []).append(msg)
+        return out
+
+
+def _to_float(col):
+    arr = np.asarray(col)
+    if arr.dtype.kind in "biuf":
+        return arr.astype(np.float64, copy=False)
+    if arr.dtype.kind in "US":
+        stripped = np.char.strip(arr.astype(str))
+        try:
+            return np.where(stripped == "", "nan", stripped).astype(np.float64)
+        except ValueError:
+            pass
+    # Slow path for object columns or text with malformed entries.
+    def conv(v):
+        try:
+            return float(v)
+        except (TypeError, ValueError):
+            return np.nan
+
+    return np.frompyfunc(conv, 1, 1)(arr).astype(np.float64)
+
+
+def _encode_choice(spec, col):
+    arr = np.asarray(col)
+    if arr.dtype.kind in "biuf":
+        codes = arr.astype(np.float64)
+    else:
+        text = np.char.lower(np.char.strip(arr.astype(str)))
+        codes = np.full(text.shape, np.nan)
+        for code, label in enumerate(spec.choices):
+            codes[text == label.lower()] = code
+        # Already-encoded values given as text ("1", "1.0", or floats in an
+        # object array); range and integrality are checked below like numbers.
+        unlabelled = np.isnan(codes)
+        codes[unlabelled] = _to_float(text[unlabelled])
+        # Unrecognised non-blank text is an unknown category, not a missing value.
+        codes[np.isnan(codes) & (text != "") & (text != "nan")] = -1
+    ok = np.isin(codes, np.arange(len(spec.choices)))
+    return codes, ok
+
+
+def validate_and_encode(schema, data):
+    """Validate and encode a column-oriented batch.
+
+    `data` maps feature name -> 1-D array-like (or a 2-D array in schema
+    order). Numeric columns may be numbers or numeric text; choice columns may
+    be labels ("Yes", "positive", ...) or codes. All checks are boolean masks
+    over whole columns.
+    """
+    if not isinstance(data, dict):
+        arr = np.asarray(data)
+        arr = arr.reshape(-1, len(schema)) if arr.ndim < 2 else arr
+        data = {spec.name: arr[:, j] for j, spec in enumerate(schema)}
+
+    present = [spec.name for spec in schema if spec.name in data]
+    n = len(np.atleast_1d(data[present[0]])) if present else 0
+
+    X = np.full((n, len(schema)), np.nan)
+    error_code = np.zeros((n, len(schema)), dtype=np.int8)
+
+    for j, spec in enumerate(schema):
+        if spec.name not in data:
+            error_code[:, j] = MISSING
+            continue
+        col = np.atleast_1d(data[spec.name])
+        if len(col) != n:
+            raise ValueError(f"column '{spec.name}' has {len(col)} rows, expected {n}")
+
+        if spec.is_choice:
+            values, ok = _encode_choice(spec, col)
+            error_code[:, j] = np.where(ok, OK, np.where(np.isnan(values), MISSING, UNKNOWN_CHOICE))
+        else:
+            values = _to_float(col)
+            missing = ~np.isfinite(values)
+            below = values < spec.min_value
+            above = values > spec.max_value
+            frac = (spec.kind == "int") & (values != np.round(values))
+            code = np.select(
+                [missing, below, above, frac],
+                [MISSING, BELOW_MIN, ABOVE_MAX, NOT_INTEGER],
+                OK,
+            )
+            error_code[:, j] = code
+            ok = code == OK
+
+        X[:, j] = np.where(ok, values, np.nan)
+
+    return ValidationResult(schema, X, error_code)
+
+
+def encode_record(schema, values):
+    """Validate one record (feature -> raw value) and return it encoded.
+
+    Used by the pages and the API; raises ValueError listing every problem.
+    """
+    result = validate_and_encode(schema, {k: [v] for k, v in values.items()})
+    if not result.valid[0]:
+        raise ValueError("; ".join(result.row_errors()[0]))
+    record = {}
+    for j, spec in enumerate(schema):
+        v = result.X[0, j]
+        record[spec.name] = float(v) if spec.kind == "float" else int(v)
+    return record
+
+
+def random_records(schema, n, rng=None):
+    # Uniform random valid rows (encoded), e.g. for load tests and benchmarks.
+    rng = np.random.default_rng(rng)
+    X = np.empty((n, len(schema)))
+    for j, spec in enumerate(schema):
+        if spec.is_choice:
+            X[:, j] = rng.integers(0, len(spec.choices), n)
+        elif spec.kind == "int":
+            X[:, j] = rng.integers(int(spec.min_value), int(spec.max_value) + 1, n)
+        else:
+            steps = int(round((spec.max_value - spec.min_value) / spec.step))
+            X[:, j] = spec.min_value + rng.integers(0, steps + 1, n) * spec.step
+    return X
@@ -2,14 +2,25 @@ import streamlit as st
 import numpy as np
 
 from utils import (
-    load_models,
+    EXPLAIN_MODE,
     FEATURES_DS3,
     get_shap_values,
     plot_shap_bar,
     plot_shap_waterfall,
     create_pdf_report,
     format_risk_label,
+    feature_widget,
+    plot_png,
 )
+from audit_log import get_audit_logger
+from drift_monitor import get_drift_monitor
+from model_registry import get_registry
+from memory_guard import current_session_id, get_memory_guard, render_cached_result
+from admission import run_or_defer
+from counterfactual import render_counterfactual_search
+from feature_schema import SCHEMA_DS3, spec_map, encode_record
+
+SPECS = spec_map(SCHEMA_DS3)
 
 
 def risk_color(label: str):
@@ -21,8 +32,106 @@ def risk_color(label: str):
     return "#F5B041"       # moderate (orange)
 
 
+def render_explanation(bundle, x, row_key, pred, classes, proba, input_data, nice_label):
+    model_ds3 = bundle.models["ds3"]
+    explainer_ds3 = bundle.explainers["ds3"]
+
+    # ---------------- XAI (SHAP) ----------------
+    st.markdown("### 🧠 Why did the model say this?")
+    st.markdown(
+        "<p class='section-caption'>These plots show which features pushed the prediction higher or lower.</p>",
+        unsafe_allow_html=True,
+    )
+    if EXPLAIN_MODE == "approx":
+        st.caption("Approximate explanation mode: the feature ranking can differ from exact SHAP.")
+
+    shap_values, base_value = bundle.cached(
+        ("ds3", "shap", row_key),
+        lambda: get_shap_values(
+            model_ds3,
+            x,
+            predicted_class_index=int(pred) if classes is not None else None,
+            explainer=explainer_ds3,
+        ),
+    )
+
+    tab_bar, tab_waterfall = st.tabs(["Bar Plot (feature impact)", "Waterfall Plot (step-by-step)"])
+
+    with tab_bar:
+        st.markdown("<div class='shap-card'>", unsafe_allow_html=True)
+        bar_png = plot_png(plot_shap_bar, shap_values, FEATURES_DS3, "Feature impact on prediction")
+        st.image(bar_png, use_container_width=True)
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    with tab_waterfall:
+        st.markdown("<div class='shap-card'>", unsafe_allow_html=True)
+        waterfall_png = plot_png(
+            plot_shap_waterfall, shap_values, base_value, x[0], FEATURES_DS3, "How each feature shifts risk"
+        )
+        st.image(waterfall_png, use_container_width=True)
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    st.markdown("#### In simple terms")
+    st.write(
+        "Bars pushing **to the right** increase the estimated risk, while bars pushing "
+        "**to the left** reduce it."
+    )
+
+    idx_sorted = np.argsort(np.abs(shap_values))[::-1]
+    top3 = idx_sorted[:3]
+    st.write("**Top contributing factors for this patient:**")
+    for i in top3:
+        direction = "raised the risk" if shap_values[i] > 0 else "lowered the risk"
+        st.write(f"- **{FEATURES_DS3[i]}** → {direction}")
+
+    # ---------------- PDF ----------------
+    st.markdown("### 📄 Download report")
+
+    top5 = idx_sorted[:5]
+    top_contribs = [(FEATURES_DS3[i], float(shap_values[i])) for i in top5]
+
+    proba_dict = (
+        {str(c): float(p) for c, p in zip(classes, proba)}
+        if (proba is not None and classes is not None)
+        else None
+    )
+
+    pdf_buffer = create_pdf_report(
+        model_name="General Maternal Model",
+        input_dict=input_data,
+        pred_label=nice_label,
+        proba_dict=proba_dict,
+        shap_contribs=top_contribs,
+        model_version=bundle.version,
+    )
+
+    # Keep this result (as bytes, not live figures) within the server memory budget.
+    get_memory_guard().put(
+        current_session_id(),
+        "general",
+        {
+            "label": nice_label,
+            "bar_png": bar_png,
+            "waterfall_png": waterfall_png,
+            "pdf": pdf_buffer.getvalue(),
+            "shap_values": shap_values,
+            "x": x,
+        },
+    )
+
+    st.download_button(
+        label="⬇️ Download PDF Report",
+        data=pdf_buffer,
+        file_name="maternal_risk_report_general.pdf",
+        mime="application/pdf",
+        use_container_width=True,
+    )
+
+
 def render_general_model():
-    model_ds2, model_ds3 = load_models()
+    # One bundle per request: a model swap mid-request cannot mix versions.
+    bundle = get_registry().active()
+    backend_ds3 = bundle.backends["ds3"]
 
     st.header("🧮 General Maternal Model")
     st.markdown(
@@ -38,21 +147,17 @@ def render_general_model():
     with col_left:
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.markdown("##### Pregnancy details & vitals", unsafe_allow_html=False)
-        age = st.number_input("Age (years)", min_value=10, max_value=60, value=25, step=1)
-        diastolic = st.number_input("Diastolic BP (mmHg)", min_value=40, max_value=130, value=80, step=1)
-        bs = st.number_input("Blood Sugar (BS)", min_value=40, max_value=400, value=100, step=1)
-        bmi = st.number_input("BMI", min_value=10.0, max_value=60.0, value=24.0, step=0.1)
-        heart_rate = st.number_input("Heart rate (bpm)", min_value=40, max_value=200, value=80, step=1)
+        values = {}
+        for name in ["Age", "Diastolic", "BS", "BMI", "Heart Rate"]:
+            values[name] = feature_widget(SPECS[name])
         st.markdown("</div>", unsafe_allow_html=True)
 
     # RIGHT: clinical history
     with col_right:
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.markdown("##### Clinical history", unsafe_allow_html=False)
-        prev_comp = st.radio("Previous complications", ["No", "Yes"], horizontal=True)
-        pre_diab = st.radio("Preexisting diabetes", ["No", "Yes"], horizontal=True)
-        gest_diab = st.radio("Gestational diabetes", ["No", "Yes"], horizontal=True)
-        mental_health = st.radio("Mental health issue", ["No", "Yes"], horizontal=True)
+        for name in ["Previous Complications", "Preexisting Diabetes", "Gestational Diabetes", "Mental Health"]:
+            values[name] = feature_widget(SPECS[name])
         st.markdown("</div>", unsafe_allow_html=True)
 
     # ---------------- ACTION BUTTONS ----------------
@@ -67,27 +172,22 @@ def render_general_model():
         st.session_state["page"] = "Home"
         return
     if not predict_clicked:
+        render_cached_result("general", "maternal_risk_report_general.pdf")
         return
 
     # ---------------- PREPARE INPUTS ----------------
-    yn = {"No": 0, "Yes": 1}
-    input_data = {
-        "Age": age,
-        "Diastolic": diastolic,
-        "BS": bs,
-        "BMI": bmi,
-        "Previous Complications": yn[prev_comp],
-        "Preexisting Diabetes": yn[pre_diab],
-        "Gestational Diabetes": yn[gest_diab],
-        "Mental Health": yn[mental_health],
-        "Heart Rate": heart_rate,
-    }
+    try:
+        input_data = encode_record(SCHEMA_DS3, values)
+    except ValueError as exc:
+        st.error(f"Please check the inputs: {exc}")
+        return
     x = np.array([[input_data[f] for f in FEATURES_DS3]], dtype=float)
 
     # ---------------- PREDICTION ----------------
-    pred = model_ds3.predict(x)[0]
-    classes = getattr(model_ds3, "classes_", None)
-    proba = model_ds3.predict_proba(x)[0] if hasattr(model_ds3, "predict_proba") else None
+    row_key = tuple(x[0].tolist())
+    proba = bundle.cached(("ds3", "predict", row_key), lambda: backend_ds3.predict_proba(x)[0])
+    pred = int(np.argmax(proba))
+    classes = backend_ds3.classes_
 
     if classes is not None:
         raw_label = classes[int(pred)]
@@ -97,6 +197,15 @@ def render_general_model():
     nice_label = format_risk_label(raw_label)
     color = risk_color(nice_label)
 
+    get_audit_logger().log(
+        model_name="General Maternal Model",
+        input_dict=input_data,
+        pred_label=nice_label,
+        confidence=float(proba[int(pred)]) if proba is not None else None,
+        model_version=bundle.version,
+    )
+    get_drift_monitor().observe("ds3", x[0], pred)
+
     badge_class = "risk-moderate"
     if "low" in nice_label.lower():
         badge_class = "risk-low"
@@ -162,82 +271,14 @@ def render_general_model():
             for c, p in zip(classes, proba):
                 st.write(f"- {format_risk_label(c)}: `{p:.3f}`")
 
-    # ---------------- XAI (SHAP) ----------------
-    st.markdown("### 🧠 Why did the model say this?")
-    st.markdown(
-        "<p class='section-caption'>These plots show which features pushed the prediction higher or lower.</p>",
-        unsafe_allow_html=True,
-    )
-
-    shap_values, base_value = get_shap_values(
-        model_ds3,
-        x,
-        predicted_class_index=int(pred) if classes is not None else None,
-    )
-
-    tab_bar, tab_waterfall = st.tabs(["Bar Plot (feature impact)", "Waterfall Plot (step-by-step)"])
-
-    with tab_bar:
-        st.markdown("<div class='shap-card'>", unsafe_allow_html=True)
-        st.pyplot(
-            plot_shap_bar(
-                shap_values,
-                FEATURES_DS3,
-                "Feature impact on prediction",
-            )
-        )
-        st.markdown("</div>", unsafe_allow_html=True)
-
-    with tab_waterfall:
-        st.markdown("<div class='shap-card'>", unsafe_allow_html=True)
-        st.pyplot(
-            plot_shap_waterfall(
-                shap_values,
-                base_value,
-                x[0],
-                FEATURES_DS3,
-                "How each feature shifts risk",
-            )
-        )
-        st.markdown("</div>", unsafe_allow_html=True)
-
-    st.markdown("#### In simple terms")
-    st.write(
-        "Bars pushing **to the right** increase the estimated risk, while bars pushing "
-        "**to the left** reduce it."
-    )
-
-    idx_sorted = np.argsort(np.abs(shap_values))[::-1]
-    top3 = idx_sorted[:3]
-    st.write("**Top contributing factors for this patient:**")
-    for i in top3:
-        direction = "raised the risk" if shap_values[i] > 0 else "lowered the risk"
-        st.write(f"- **{FEATURES_DS3[i]}** → {direction}")
+    # ---------------- COUNTERFACTUAL (what would lower the risk?) ----------------
+    if "low" not in nice_label.lower():
+        render_counterfactual_search(bundle, "ds3", x[0])
 
-    # ---------------- PDF ----------------
-    st.markdown("### 📄 Download report")
-
-    top5 = idx_sorted[:5]
-    top_contribs = [(FEATURES_DS3[i], float(shap_values[i])) for i in top5]
-
-    proba_dict = (
-        {str(c): float(p) for c, p in zip(classes, proba)}
-        if (proba is not None and classes is not None)
-        else None
-    )
-
-    pdf_buffer = create_pdf_report(
-        model_name="General Maternal Model",
-        input_dict=input_data,
-        pred_label=nice_label,
-        proba_dict=proba_dict,
-        shap_contribs=top_contribs,
-    )
-
-    st.download_button(
-        label="⬇️ Download PDF Report",
-        data=pdf_buffer,
-        file_name="maternal_risk_report_general.pdf",
-        mime="application/pdf",
-        use_container_width=True,
+    # ---------------- EXPLANATION (admission-controlled) ----------------
+    # The prediction above is already on screen; SHAP, charts and the PDF run
+    # only when a slot is free, otherwise they are offered as "queued".
+    run_or_defer(
+        lambda: render_explanation(bundle, x, row_key, pred, classes, proba, input_data, nice_label),
+        key="general",
     )
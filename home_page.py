@@ -58,3 +58,23 @@ Use this in **antenatal clinic settings** for visit-based risk assessment.
         if st.button("Use Pregnancy / Antenatal Model", use_container_width=True):
             st.session_state["page"] = "Pregnancy"
         st.markdown("</div>", unsafe_allow_html=True)
+
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    st.markdown(
+        """
+        <div class="card-header">
+            <span class="icon">🤰</span>
+            <span>Combined Antenatal Assessment</span>
+        </div>
+        """,
+        unsafe_allow_html=True,
+    )
+    st.write(
+        """
+Have both the visit data and the clinical history? Enter everything **once** and
+get both models' results, explanations and **one combined PDF report**.
+        """
+    )
+    if st.button("Use Combined Assessment", use_container_width=True):
+        st.session_state["page"] = "Combined"
+    st.markdown("</div>", unsafe_allow_html=True)
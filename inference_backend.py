@@ -0,0 +1,100 @@
+# inference_backend.py
+"""Pluggable predict_proba engines.
+
+MRP_INFERENCE_ENGINE selects how class probabilities are computed:
+
+- "xgboost" (default): the unpickled XGBClassifier itself.
+- "onnx": ONNX Runtime on the model exported by onnx_export.py. If the
+  `.onnx` file is missing next to the pickle, or was exported from a different
+  pickle (its recorded SHA-256 does not match), the model is converted in memory.
+
+Both engines expose `predict_proba(x)` and `classes_`, so callers (pages,
+pre-fork workers, batch jobs) do not care which one is active. SHAP
+explanations always use the native model.
+"""
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from utils import XGB_NTHREAD
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_ENGINE = os.environ.get("MRP_INFERENCE_ENGINE", "xgboost").lower()
+ENGINES = ("xgboost", "onnx")
+# ONNX metadata_props key holding the SHA-256 of the pickle it was exported from.
+SOURCE_HASH_KEY = "mrp_source_sha256"
+
+
+class NativeBackend:
+    name = "xgboost"
+
+    def __init__(self, model):
+        self.model = model
+        self.classes_ = getattr(model, "classes_", None)
+
+    def predict_proba(self, x):
+        return self.model.predict_proba(np.asarray(x, dtype=float))
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, onnx_bytes, classes, nthread=XGB_NTHREAD):
+        try:
+            import onnxruntime as ort
+        except ImportError as exc:
+            raise ImportError(
+                "MRP_INFERENCE_ENGINE=onnx needs onnxruntime (pip install onnxruntime)"
+            ) from exc
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = max(1, int(nthread))
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(onnx_bytes, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.classes_ = classes
+
+    def predict_proba(self, x):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        (proba,) = self.session.run(["probabilities"], {self.input_name: x})
+        return proba
+
+
+def onnx_path_for(pickle_path):
+    return os.path.splitext(pickle_path)[0] + ".onnx"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_backend(model, pickle_path=None, engine=None, nthread=XGB_NTHREAD):
+    engine = (engine or INFERENCE_ENGINE).lower()
+    if engine == "xgboost":
+        return NativeBackend(model)
+    if engine != "onnx":
+        raise ValueError(f"Unknown inference engine '{engine}', expected one of {ENGINES}")
+
+    classes = getattr(model, "classes_", None)
+    path = onnx_path_for(pickle_path) if pickle_path else None
+    if path and os.path.isfile(path):
+        with open(path, "rb") as f:
+            backend = OnnxBackend(f.read(), classes, nthread)
+        # The .onnx files are build artifacts; a pickle replaced in place must
+        # not keep serving the old model's probabilities.
+        exported_from = backend.session.get_modelmeta().custom_metadata_map.get(SOURCE_HASH_KEY)
+        if exported_from == file_sha256(pickle_path):
+            return backend
+        logger.warning("%s was not exported from the current %s; converting in memory", path, pickle_path)
+    else:
+        logger.warning("No ONNX file for %s; converting in memory", pickle_path or "model")
+
+    from onnx_export import convert_model
+
+    return OnnxBackend(convert_model(model).SerializeToString(), classes, nthread)
@@ -0,0 +1,320 @@
+# load_test.py
+"""Load test: N simulated clinicians submitting random patients concurrently.
+
+    python load_test.py pipeline --sessions 8 --duration 30
+    python load_test.py app --sessions 4 --requests 10
+    python load_test.py pipeline --sessions 1,2,4,8 --duration 20 --json out.json
+    python load_test.py pipeline --sessions 8 --duration 20 --admission
+
+"pipeline" drives the same stages a page runs after "Predict & Explain"
+(predict, explain, plot, pdf) from one thread per session, against the active
+model bundle. "app" drives app.py itself through Streamlit's testing API
+(AppTest), one app instance per session, and times whole reruns. Its
+predictions go to a scratch audit log (--audit-db), not audit_log.db.
+
+Reports throughput, p50/p95/p99 latency per stage, and CPU / RSS sampled over
+the run, to help size deployments.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+import numpy as np
+
+from admission import AdmissionController
+from feature_schema import SCHEMAS, random_records
+from model_registry import get_registry
+from prefork_pool import memory_kb
+from utils import (
+    FEATURES_DS2,
+    FEATURES_DS3,
+    create_pdf_report,
+    format_risk_label,
+    get_shap_values,
+    plot_shap_bar,
+    plot_shap_waterfall,
+    plot_png,
+)
+
+FEATURES = {"ds2": FEATURES_DS2, "ds3": FEATURES_DS3}
+MODEL_NAMES = {"ds2": "Pregnancy / Antenatal Model", "ds3": "General Maternal Model"}
+PAGES = {"ds2": ("Pregnancy", "predict_pregnancy"), "ds3": ("General", "predict_general")}
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}   # stage -> [seconds]
+        self.errors = {}    # stage -> count
+        self.completed = 0
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def error(self, stage):
+        with self._lock:
+            self.errors[stage] = self.errors.get(stage, 0) + 1
+
+    def done(self):
+        with self._lock:
+            self.completed += 1
+
+
+class ResourceSampler(threading.Thread):
+    """Samples process CPU utilisation and RSS every `interval` seconds."""
+
+    def __init__(self, interval=0.5):
+        super().__init__(name="load-test-sampler", daemon=True)
+        self.interval = interval
+        self.timeline = []  # (elapsed_s, cpu_percent, rss_kb)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        start = last_wall = time.perf_counter()
+        last_cpu = sum(os.times()[:2])
+        while not self._stop_event.wait(self.interval):
+            wall, cpu = time.perf_counter(), sum(os.times()[:2])
+            cpu_pct = 100.0 * (cpu - last_cpu) / max(wall - last_wall, 1e-9)
+            self.timeline.append((wall - start, cpu_pct, memory_kb()["rss_kb"]))
+            last_wall, last_cpu = wall, cpu
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+# ---------------- Pipeline sessions ----------------
+def _timed(recorder, stage, fn):
+    start = time.perf_counter()
+    try:
+        return fn()
+    except Exception:
+        recorder.error(stage)
+        raise
+    finally:
+        recorder.add(stage, time.perf_counter() - start)
+
+
+def pipeline_request(bundle, key, x, recorder, admission=None):
+    backend = bundle.backends[key]
+    request_start = time.perf_counter()
+
+    proba = _timed(recorder, "predict", lambda: backend.predict_proba(x)[0])
+    pred = int(np.argmax(proba))
+    label = format_risk_label(backend.classes_[pred])
+    if admission is None:
+        _explain_request(bundle, key, x, proba, pred, label, recorder)
+    else:
+        # Shed requests stop after predict, as the app's degraded mode does.
+        with admission.admit() as admitted:
+            if admitted:
+                _explain_request(bundle, key, x, proba, pred, label, recorder)
+    recorder.add("total", time.perf_counter() - request_start)
+
+
+def _explain_request(bundle, key, x, proba, pred, label, recorder):
+    features = FEATURES[key]
+    backend = bundle.backends[key]
+    shap_values, base_value = _timed(
+        recorder,
+        "explain",
+        lambda: get_shap_values(bundle.models[key], x, pred, explainer=bundle.explainers[key]),
+    )
+
+    def plot():
+        plot_png(plot_shap_bar, shap_values, features, "Feature impact on prediction")
+        plot_png(plot_shap_waterfall, shap_values, base_value, x[0], features, "How each feature shifts risk")
+
+    _timed(recorder, "plot", plot)
+
+    top = np.argsort(np.abs(shap_values))[::-1][:5]
+    _timed(
+        recorder,
+        "pdf",
+        lambda: create_pdf_report(
+            model_name=MODEL_NAMES[key],
+            input_dict=dict(zip(features, x[0].tolist())),
+            pred_label=label,
+            proba_dict={str(c): float(p) for c, p in zip(backend.classes_, proba)},
+            shap_contribs=[(features[i], float(shap_values[i])) for i in top],
+            model_version=bundle.version,
+        ),
+    )
+
+
+def _pipeline_session(seed, deadline, max_requests, recorder, admission=None):
+    rng = np.random.default_rng(seed)
+    done = 0
+    while time.perf_counter() < deadline and (max_requests is None or done < max_requests):
+        bundle = get_registry().active()
+        key = "ds2" if rng.random() < 0.5 else "ds3"
+        try:
+            pipeline_request(bundle, key, random_records(SCHEMAS[key], 1, rng), recorder, admission)
+            recorder.done()
+        except Exception:
+            recorder.error("total")
+        done += 1
+
+
+# ---------------- App sessions (Streamlit AppTest) ----------------
+def isolate_app(audit_db):
+    # app.py runs in this process, so point its audit log at a scratch file and
+    # keep synthetic traffic out of the drift metrics. Must run before the
+    # first AppTest imports the pages (both modules read env at import time).
+    import sys
+
+    for module in ("audit_log", "drift_monitor"):
+        if module in sys.modules:
+            raise RuntimeError(f"{module} was imported before the load test could isolate it")
+    os.environ["MRP_AUDIT_DB"] = audit_db
+    os.environ.pop("MRP_DRIFT_METRICS_FILE", None)
+
+
+def _set_random_inputs(at, key, rng):
+    x = random_records(SCHEMAS[key], 1, rng)[0]
+    specs = {spec.label: (spec, value) for spec, value in zip(SCHEMAS[key], x)}
+    for widget in list(at.number_input) + list(at.radio):
+        if widget.label in specs:
+            spec, value = specs[widget.label]
+            if spec.is_choice:
+                widget.set_value(spec.choices[int(value)])
+            else:
+                widget.set_value(int(value) if spec.kind == "int" else float(value))
+
+
+def _app_session(seed, deadline, max_requests, recorder, admission=None):
+    from streamlit.testing.v1 import AppTest
+
+    rng = np.random.default_rng(seed)
+    done = 0
+    while time.perf_counter() < deadline and (max_requests is None or done < max_requests):
+        key = "ds2" if rng.random() < 0.5 else "ds3"
+        page, button = PAGES[key]
+        try:
+            at = AppTest.from_file(APP_PATH, default_timeout=120)
+            at.session_state["page"] = page
+            _timed(recorder, "page_load", at.run)
+            _set_random_inputs(at, key, rng)
+            _timed(recorder, "predict_and_explain", lambda: at.button(key=button).click().run())
+            if at.exception:
+                recorder.error("predict_and_explain")
+            else:
+                recorder.done()
+        except Exception:
+            recorder.error("session")
+        done += 1
+
+
+# ---------------- Driver and report ----------------
+def run(mode, sessions, duration, max_requests=None, sample_interval=0.5, seed=0, admission=False):
+    get_registry().active()  # load/warm before the clock starts
+    recorder = Recorder()
+    # The app applies its own admission control; in pipeline mode it is opt-in.
+    controller = AdmissionController() if admission and mode == "pipeline" else None
+    sampler = ResourceSampler(sample_interval)
+    target = _pipeline_session if mode == "pipeline" else _app_session
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=target, args=(seed + i, deadline, max_requests, recorder, controller), daemon=True)
+        for i in range(sessions)
+    ]
+    sampler.start()
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+
+    stages = {}
+    for stage, values in recorder.samples.items():
+        arr = np.asarray(values) * 1000
+        p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+        stages[stage] = {"count": len(arr), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "max_ms": arr.max()}
+    timeline = sampler.timeline
+    return {
+        "mode": mode,
+        "sessions": sessions,
+        "seconds": elapsed,
+        "completed": recorder.completed,
+        "throughput_rps": recorder.completed / elapsed if elapsed else 0.0,
+        "errors": recorder.errors,
+        "admission": controller.stats() if controller is not None else None,
+        "stages": stages,
+        "cpu_percent_mean": float(np.mean([t[1] for t in timeline])) if timeline else None,
+        "cpu_percent_max": float(np.max([t[1] for t in timeline])) if timeline else None,
+        "rss_kb_max": max((t[2] for t in timeline if t[2]), default=None),
+        "timeline": timeline,
+    }
+
+
+def print_report(r):
+    print(
+        f"\n{r['mode']}: {r['sessions']} sessions, {r['completed']} requests in {r['seconds']:.1f} s "
+        f"-> {r['throughput_rps']:.2f} req/s"
+    )
+    if r["errors"]:
+        print(f"errors: {r['errors']}")
+    if r["admission"]:
+        a = r["admission"]
+        print(f"admission: admitted {a['admitted']}, queued {a['queued']}, shed {a['shed']}, timed out {a['timed_out']}")
+    print(f"{'stage':>20} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for stage, s in r["stages"].items():
+        print(
+            f"{stage:>20} {s['count']:>7} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['max_ms']:>9.1f}"
+        )
+    if r["timeline"]:
+        peak = "n/a" if r["rss_kb_max"] is None else f"{r['rss_kb_max'] / 1024:.0f} MB"
+        print(f"CPU mean {r['cpu_percent_mean']:.0f}% (max {r['cpu_percent_max']:.0f}%), peak RSS {peak}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["pipeline", "app"])
+    parser.add_argument("--sessions", default="4", help="concurrent sessions; comma-separated for a sweep")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per run")
+    parser.add_argument("--requests", type=int, default=None, help="stop each session after this many requests")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="CPU/RSS sampling period (s)")
+    parser.add_argument(
+        "--admission", action="store_true", help="pipeline mode: limit explain/plot/pdf like the app does"
+    )
+    parser.add_argument(
+        "--audit-db",
+        default=None,
+        help="app mode: audit log for the synthetic predictions (default: a temporary file, deleted afterwards)",
+    )
+    parser.add_argument("--json", help="write full results (including the CPU/RSS timeline) to this file")
+    args = parser.parse_args()
+
+    scratch = None
+    if args.mode == "app":
+        if args.audit_db is None:
+            fd, scratch = tempfile.mkstemp(prefix="load_test_audit_", suffix=".db")
+            os.close(fd)
+        isolate_app(args.audit_db or scratch)
+
+    results = []
+    for n in [int(s) for s in args.sessions.split(",") if s.strip()]:
+        r = run(args.mode, n, args.duration, args.requests, args.sample_interval, admission=args.admission)
+        print_report(r)
+        results.append(r)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if scratch:
+        from audit_log import get_audit_logger
+
+        get_audit_logger().close()
+        os.remove(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# memory_guard.py
+"""Per-session memory accounting and a server-wide budget for cached results.
+
+Each session keeps its latest charts (PNG bytes), PDF report and SHAP arrays
+here instead of holding on to live Matplotlib figures. Every entry is sized
+when stored, and the guard keeps the total under MRP_MEMORY_BUDGET_MB by
+evicting whole sessions, least recently used first. Sessions idle for longer
+than MRP_SESSION_IDLE_SECONDS are dropped as well.
+
+With MRP_TRACEMALLOC=1 (or the button in the diagnostics view) tracemalloc is
+running, and the diagnostics view compares the accounted total with what
+tracemalloc sees and lists the top allocation sites.
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+
+MEMORY_BUDGET_MB = float(os.environ.get("MRP_MEMORY_BUDGET_MB", "256"))
+SESSION_IDLE_SECONDS = float(os.environ.get("MRP_SESSION_IDLE_SECONDS", "1800"))
+TRACEMALLOC_FRAMES = int(os.environ.get("MRP_TRACEMALLOC_FRAMES", "1"))
+
+if os.environ.get("MRP_TRACEMALLOC") == "1" and not tracemalloc.is_tracing():
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+
+
+def nbytes_of(value):
+    # Payload size of what the pages cache: bytes, buffers, arrays and containers of them.
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, BytesIO):
+        return value.getbuffer().nbytes
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(nbytes_of(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(nbytes_of(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class MemoryGuard:
+    def __init__(self, budget_mb=MEMORY_BUDGET_MB, idle_seconds=SESSION_IDLE_SECONDS):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.idle_seconds = idle_seconds
+        self._sessions = OrderedDict()  # session_id -> {"entries": {name: (value, nbytes)}, "last_access": t}
+        self._lock = threading.Lock()
+        self.evicted_sessions = 0
+        self.evicted_bytes = 0
+
+    # ---------------- Session cache ----------------
+    def put(self, session_id, name, value):
+        size = nbytes_of(value)
+        with self._lock:
+            session = self._sessions.setdefault(session_id, {"entries": {}, "last_access": 0.0})
+            session["entries"][name] = (value, size)
+            session["last_access"] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            self._enforce_locked(keep=session_id)
+        return size
+
+    def get(self, session_id, name):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or name not in session["entries"]:
+                return None
+            session["last_access"] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session["entries"][name][0]
+
+    def drop(self, session_id, name=None):
+        with self._lock:
+            if name is None:
+                self._sessions.pop(session_id, None)
+            elif session_id in self._sessions:
+                self._sessions[session_id]["entries"].pop(name, None)
+
+    def _session_bytes(self, session):
+        return sum(size for _, size in session["entries"].values())
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(self._session_bytes(s) for s in self._sessions.values())
+
+    def _evict_locked(self, session_id):
+        session = self._sessions.pop(session_id)
+        self.evicted_sessions += 1
+        self.evicted_bytes += self._session_bytes(session)
+
+    def _enforce_locked(self, keep=None):
+        now = time.monotonic()
+        for sid in [s for s, v in self._sessions.items() if now - v["last_access"] > self.idle_seconds]:
+            self._evict_locked(sid)
+        total = sum(self._session_bytes(s) for s in self._sessions.values())
+        # Oldest first (the OrderedDict is kept in access order); the session
+        # that is writing right now is evicted last.
+        for sid in list(self._sessions):
+            if total <= self.budget_bytes:
+                break
+            if sid == keep and len(self._sessions) > 1:
+                continue
+            total -= self._session_bytes(self._sessions[sid])
+            self._evict_locked(sid)
+
+    def enforce(self):
+        with self._lock:
+            self._enforce_locked()
+
+    # ---------------- Diagnostics ----------------
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            sessions = [
+                {
+                    "session": sid,
+                    "bytes": self._session_bytes(s),
+                    "entries": {name: size for name, (_, size) in s["entries"].items()},
+                    "idle_s": now - s["last_access"],
+                }
+                for sid, s in reversed(self._sessions.items())
+            ]
+        return {
+            "budget_bytes": self.budget_bytes,
+            "total_bytes": sum(s["bytes"] for s in sessions),
+            "sessions": sessions,
+            "evicted_sessions": self.evicted_sessions,
+            "evicted_bytes": self.evicted_bytes,
+        }
+
+
+def top_allocations(limit=15):
+    """Top tracemalloc sites by size as (site, size_bytes, count); [] if not tracing."""
+    if not tracemalloc.is_tracing():
+        return []
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        )
+    )
+    out = []
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        out.append((f"{frame.filename}:{frame.lineno}", stat.size, stat.count))
+    return out
+
+
+# ---------------- Process-wide instance ----------------
+_guard = None
+_guard_lock = threading.Lock()
+
+
+def get_memory_guard():
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                _guard = MemoryGuard()
+    return _guard
+
+
+def current_session_id():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "local"
+
+
+def render_memory_diagnostics():
+    import streamlit as st
+
+    guard = get_memory_guard()
+    stats = guard.stats()
+    mb = 1024 * 1024
+    st.markdown(
+        f"**Cached results:** {stats['total_bytes'] / mb:.1f} MB of {stats['budget_bytes'] / mb:.0f} MB budget, "
+        f"{len(stats['sessions'])} sessions"
+    )
+    st.markdown(
+        f"**Evicted:** {stats['evicted_sessions']} sessions, {stats['evicted_bytes'] / mb:.1f} MB"
+    )
+    if stats["sessions"]:
+        st.table(
+            [
+                {
+                    "session": s["session"][:8],
+                    "KB": round(s["bytes"] / 1024, 1),
+                    "entries": ", ".join(s["entries"]),
+                    "idle (s)": round(s["idle_s"]),
+                }
+                for s in stats["sessions"]
+            ]
+        )
+
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        st.markdown(f"**tracemalloc:** {current / mb:.1f} MB traced (peak {peak / mb:.1f} MB)")
+        st.table(
+            [
+                {"site": site, "KB": round(size / 1024, 1), "blocks": count}
+                for site, size, count in top_allocations()
+            ]
+        )
+        if st.button("Stop tracemalloc", key="diag_stop_tracemalloc"):
+            tracemalloc.stop()
+    elif st.button("Start tracemalloc", key="diag_start_tracemalloc"):
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+
+def render_cached_result(name, file_name):
+    # Re-show a page's last result (e.g. after the rerun a download click causes).
+    import streamlit as st
+
+    result = get_memory_guard().get(current_session_id(), name)
+    if result is None:
+        return False
+    with st.expander(f"Last result: {result['label']}", expanded=False):
+        col_bar, col_waterfall = st.columns(2)
+        with col_bar:
+            st.image(result["bar_png"], use_container_width=True)
+        with col_waterfall:
+            st.image(result["waterfall_png"], use_container_width=True)
+        st.download_button(
+            label="⬇️ Download PDF Report",
+            data=result["pdf"],
+            file_name=file_name,
+            mime="application/pdf",
+            use_container_width=True,
+            key=f"cached_download_{name}",
+        )
+    return True
@@ -0,0 +1,253 @@
+# model_registry.py
+"""Versioned model registry with background loading and atomic swap.
+
+Model versions live in sub-directories of MRP_MODEL_DIR (default `models/`),
+each holding both pickles under their usual file names:
+
+    models/
+        2026-10-01/best_xgbc_modelds2.pkl
+        2026-10-01/best_xgbc_model3.pkl
+        2026-11-15/...
+
+The highest version (natural sort order) is served. Without any versioned
+directory the pickles in the repository root are served as "baseline".
+
+When a newer version appears, it is loaded, explained and warmed up in a
+background thread while the current version keeps serving; the active bundle
+reference is then replaced in one assignment, so every request sees either the
+old or the new version, never a mix. Prediction/explanation caches live on the
+bundle and are dropped with it.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from inference_backend import NativeBackend, make_backend
+from utils import (
+    MODEL_DS2_PATH,
+    MODEL_DS3_PATH,
+    XGB_NTHREAD,
+    build_explainer,
+    read_models,
+    set_model_nthread,
+)
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.environ.get("MRP_MODEL_DIR", "models")
+MODEL_POLL_INTERVAL = float(os.environ.get("MRP_MODEL_POLL_INTERVAL", "30"))  # seconds
+BUNDLE_CACHE_SIZE = int(os.environ.get("MRP_BUNDLE_CACHE_SIZE", "512"))  # cached results per version
+BASELINE_VERSION = "baseline"
+
+
+class ModelBundle:
+    """Both models and explainers of one version, plus that version's result cache."""
+
+    def __init__(self, version, models, explainers, backends=None, cache_size=BUNDLE_CACHE_SIZE):
+        self.version = version
+        self.models = models          # {"ds2": ..., "ds3": ...}
+        self.explainers = explainers  # same keys
+        # predict_proba engines (inference_backend.py); the native model by default
+        self.backends = backends or {key: NativeBackend(model) for key, model in models.items()}
+        self.loaded_at = datetime.now()
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def cached(self, key, compute):
+        # Small LRU for per-input results; compute() runs outside the lock.
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        value = compute()
+        with self._cache_lock:
+            self._cache[key] = value
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+
+# ---------------- Discovery and loading ----------------
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def version_paths(version, model_dir=MODEL_DIR):
+    if version == BASELINE_VERSION:
+        return MODEL_DS2_PATH, MODEL_DS3_PATH
+    folder = os.path.join(model_dir, version)
+    return (
+        os.path.join(folder, os.path.basename(MODEL_DS2_PATH)),
+        os.path.join(folder, os.path.basename(MODEL_DS3_PATH)),
+    )
+
+
+def version_mtime(version, model_dir=MODEL_DIR):
+    # Latest change to a version's folder or pickles; None if they are gone.
+    paths = list(version_paths(version, model_dir))
+    if version != BASELINE_VERSION:
+        paths.append(os.path.join(model_dir, version))
+    try:
+        return max(os.stat(p).st_mtime_ns for p in paths)
+    except OSError:
+        return None
+
+
+def discover_versions(model_dir=MODEL_DIR):
+    # Complete versions only (both pickles present), oldest first.
+    found = []
+    if os.path.isdir(model_dir):
+        for name in os.listdir(model_dir):
+            if all(os.path.isfile(p) for p in version_paths(name, model_dir)):
+                found.append(name)
+    found.sort(key=_natural_key)
+    if not found and all(os.path.isfile(p) for p in version_paths(BASELINE_VERSION)):
+        found = [BASELINE_VERSION]
+    return found
+
+
+def load_bundle(version, model_dir=MODEL_DIR, nthread=XGB_NTHREAD, warm=True, engine=None):
+    paths = dict(zip(("ds2", "ds3"), version_paths(version, model_dir)))
+    model_ds2, model_ds3 = read_models(paths["ds2"], paths["ds3"])
+    models = {"ds2": model_ds2, "ds3": model_ds3}
+    for model in models.values():
+        set_model_nthread(model, nthread)
+    explainers = {key: build_explainer(model) for key, model in models.items()}
+    backends = {key: make_backend(model, paths[key], engine, nthread) for key, model in models.items()}
+    bundle = ModelBundle(version, models, explainers, backends)
+    if warm:
+        from warmup import warm_bundle
+
+        warm_bundle(bundle)
+    return bundle
+
+
+# ---------------- Registry ----------------
+class ModelRegistry:
+    def __init__(self, model_dir=MODEL_DIR, poll_interval=MODEL_POLL_INTERVAL):
+        self.model_dir = model_dir
+        self.poll_interval = poll_interval
+        self._active = None
+        self._lock = threading.Lock()
+        self._loading = None
+        self._last_poll = 0.0
+        self._failed = None  # (version, mtime) of the last version that failed to load
+        self._versions = []  # from the last directory scan
+        self.pinned = None  # version chosen with activate(); refresh() leaves it alone
+        self.last_error = None
+
+    def active(self):
+        """The bundle new requests should use (loaded synchronously the first time)."""
+        bundle = self._active
+        if bundle is None:
+            with self._lock:
+                if self._active is None:
+                    versions = self._versions = discover_versions(self.model_dir)
+                    if not versions:
+                        raise FileNotFoundError(f"No model versions found in '{self.model_dir}'")
+                    self._active = load_bundle(versions[-1], self.model_dir)
+                bundle = self._active
+        return bundle
+
+    @property
+    def loading(self):
+        return self._loading
+
+    def refresh(self, force=False):
+        """Start loading the newest version in the background if it is not active.
+
+        Cheap enough to call on every rerun: the directory is only scanned once
+        per poll interval unless `force` is set. While a version is pinned (see
+        activate()) the list is still refreshed but nothing is swapped in.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_poll < self.poll_interval:
+            return False
+        self._last_poll = now
+        versions = self._versions = discover_versions(self.model_dir)
+        if not versions or self.pinned is not None:
+            return False
+        # A version that failed is retried once its files change (e.g. a
+        # corrected artifact published under the same name).
+        if self._failed is not None and self._failed == (versions[-1], version_mtime(versions[-1], self.model_dir)):
+            return False
+        return self._start_load(versions[-1])
+
+    def activate(self, version):
+        """Load `version` in the background, swap it in and pin it (e.g. to roll back).
+
+        refresh() does not upgrade past a pinned version; call unpin() to go
+        back to following the newest one.
+        """
+        self.pinned = version
+        return self._start_load(version)
+
+    def unpin(self):
+        """Resume automatic upgrades; the newest version is picked up on the next refresh()."""
+        self.pinned = None
+        self._last_poll = 0.0
+
+    def _start_load(self, version):
+        with self._lock:
+            # Nothing active yet: active() does the first (synchronous) load.
+            if self._active is None or self._loading is not None:
+                return False
+            if version == self._active.version:
+                return False
+            self._loading = version
+        thread = threading.Thread(target=self._load_and_swap, args=(version,), name="model-loader", daemon=True)
+        thread.start()
+        return True
+
+    def _load_and_swap(self, version):
+        mtime = version_mtime(version, self.model_dir)
+        try:
+            bundle = load_bundle(version, self.model_dir)
+        except Exception as exc:
+            logger.exception("Loading model version %s failed; keeping the current one", version)
+            self.last_error = f"{version}: {exc}"
+            self._failed = (version, mtime)
+            with self._lock:
+                self._loading = None
+            return
+        with self._lock:
+            old, self._active = self._active, bundle
+            self._loading = None
+            self._failed = None
+            self.last_error = None
+        if old is not None:
+            old.clear_cache()
+            logger.info("Model version %s replaced %s", version, old.version)
+
+    def status(self):
+        bundle = self._active
+        return {
+            "active": bundle.version if bundle is not None else None,
+            "loaded_at": bundle.loaded_at.isoformat(timespec="seconds") if bundle is not None else None,
+            "loading": self._loading,
+            "pinned": self.pinned,
+            "last_error": self.last_error,
+            "available": list(self._versions),
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
@@ -0,0 +1,157 @@
+# onnx_export.py
+"""Export both models to ONNX, check parity and compare engine speed.
+
+    python onnx_export.py                      # export the newest model version
+    python onnx_export.py --version baseline   # export a specific version
+    python onnx_export.py --check              # parity gate first: exits 1, writing nothing, if any
+                                               # class probability differs by more than PARITY_ATOL
+    python onnx_export.py --bench 1,64,100000  # latency/throughput per batch size
+
+The .onnx files are written next to the pickles (e.g. best_xgbc_model3.onnx),
+where inference_backend.py looks for them. Each records the SHA-256 of its
+pickle, so a stale export is ignored after the pickle is replaced.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from feature_schema import SCHEMAS, random_records
+from inference_backend import (
+    ENGINES,
+    SOURCE_HASH_KEY,
+    NativeBackend,
+    OnnxBackend,
+    file_sha256,
+    make_backend,
+    onnx_path_for,
+)
+from model_registry import discover_versions, load_bundle, version_paths
+from utils import XGB_NTHREAD
+
+PARITY_ATOL = 1e-5
+
+
+def convert_model(model):
+    from onnxmltools.convert import convert_xgboost
+    from onnxmltools.convert.common.data_types import FloatTensorType
+
+    n_features = model.n_features_in_
+    # Convert the Booster: pickles from older xgboost versions lack attributes
+    # that the sklearn-wrapper path of the converter reads.
+    return convert_xgboost(
+        model.get_booster(),
+        initial_types=[("input", FloatTensorType([None, n_features]))],
+        target_opset=15,
+    )
+
+
+def export_version(version, out_dir=None):
+    """Write one .onnx per model next to its pickle (or into `out_dir`); returns {key: path}."""
+    bundle = load_bundle(version, warm=False)
+    written = {}
+    for key, pickle_path in zip(("ds2", "ds3"), version_paths(version)):
+        path = onnx_path_for(pickle_path)
+        if out_dir is not None:
+            path = os.path.join(out_dir, os.path.basename(path))
+        onnx_model = convert_model(bundle.models[key])
+        entry = onnx_model.metadata_props.add()
+        entry.key, entry.value = SOURCE_HASH_KEY, file_sha256(pickle_path)
+        with open(path, "wb") as f:
+            f.write(onnx_model.SerializeToString())
+        written[key] = path
+    return written
+
+
+def check_parity(version, n_rows=5000, seed=0, atol=PARITY_ATOL):
+    """Class-probability parity of a fresh ONNX export against the native model.
+
+    The export goes to a temporary directory, so the model folder is not
+    touched. Raises AssertionError if any probability differs by more than
+    `atol` on `n_rows` random valid rows per model; otherwise returns the max
+    |diff| and argmax agreement per model.
+    """
+    bundle = load_bundle(version, warm=False)
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = export_version(version, tmp)
+        for key, model in bundle.models.items():
+            x = random_records(SCHEMAS[key], n_rows, seed)
+            native = NativeBackend(model).predict_proba(x)
+            with open(paths[key], "rb") as f:
+                onnx = OnnxBackend(f.read(), model.classes_).predict_proba(x)
+            np.testing.assert_allclose(onnx, native, rtol=0, atol=atol, err_msg=f"ONNX parity failed for {key}")
+            report[key] = {
+                "max_abs_diff": float(np.max(np.abs(native - onnx))),
+                "argmax_agreement": float(np.mean(native.argmax(axis=1) == onnx.argmax(axis=1))),
+            }
+    return report
+
+
+def bench(version, batch_sizes, min_seconds=0.5, nthread=XGB_NTHREAD):
+    bundle = load_bundle(version, warm=False)
+    paths = dict(zip(("ds2", "ds3"), version_paths(version)))
+    rows = []
+    for key, model in bundle.models.items():
+        backends = {e: make_backend(model, paths[key], engine=e, nthread=nthread) for e in ENGINES}
+        for size in batch_sizes:
+            x = random_records(SCHEMAS[key], size, 1)
+            for engine, backend in backends.items():
+                backend.predict_proba(x)  # first-call setup
+                calls, start = 0, time.perf_counter()
+                while True:
+                    backend.predict_proba(x)
+                    calls += 1
+                    elapsed = time.perf_counter() - start
+                    if elapsed >= min_seconds and calls >= 3:
+                        break
+                per_call = elapsed / calls
+                rows.append(
+                    {
+                        "model": key,
+                        "engine": engine,
+                        "batch": size,
+                        "latency_ms": per_call * 1000,
+                        "rows_per_s": size / per_call,
+                    }
+                )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--version", default=None, help="model version (default: newest)")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help=f"check class-probability parity on a temporary export first; exit 1 above {PARITY_ATOL:g}",
+    )
+    parser.add_argument("--bench", default=None, help="comma-separated batch sizes to benchmark")
+    args = parser.parse_args()
+
+    version = args.version or discover_versions()[-1]
+    if args.check:
+        try:
+            report = check_parity(version)
+        except AssertionError as exc:
+            print(f"FAIL (tolerance {PARITY_ATOL:g})\n{exc}")
+            sys.exit(1)
+        for key, r in report.items():
+            print(f"{key}: max |diff| {r['max_abs_diff']:.2e}, argmax agreement {r['argmax_agreement']:.4f}")
+        print(f"PASS: all class probabilities within {PARITY_ATOL:g}")
+
+    for path in export_version(version).values():
+        print(f"Wrote {path}")
+
+    if args.bench:
+        sizes = [int(s) for s in args.bench.split(",") if s.strip()]
+        print(f"{'model':>5} {'engine':>8} {'batch':>7} {'latency ms':>11} {'rows/s':>12}")
+        for r in bench(version, sizes):
+            print(f"{r['model']:>5} {r['engine']:>8} {r['batch']:>7} {r['latency_ms']:>11.3f} {r['rows_per_s']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
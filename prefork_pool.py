@@ -0,0 +1,282 @@
+# prefork_pool.py
+"""Pre-fork scoring service.
+
+Both models and their SHAP explainers are loaded once in the parent process.
+Workers are then forked and inherit them copy-on-write, so N workers cost far
+less than N independent loads. Each worker limits XGBoost to its share of the
+CPU cores.
+
+    python prefork_pool.py serve --workers 4 --port 8600
+    python prefork_pool.py bench --workers 1,2,4 --requests 2000
+"""
+import argparse
+import gc
+import json
+import multiprocessing as mp
+import os
+import signal
+import socket
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+
+from feature_schema import SCHEMAS, random_records, validate_and_encode
+from model_registry import discover_versions, load_bundle
+from utils import (
+    FEATURES_DS2,
+    FEATURES_DS3,
+    format_risk_label,
+    score_batch,
+    set_model_nthread,
+)
+
+# Filled in by load_shared_state() in the parent before forking.
+MODELS = {}
+EXPLAINERS = {}
+BACKENDS = {}
+FEATURES = {"ds2": FEATURES_DS2, "ds3": FEATURES_DS3}
+
+
+# ---------------- Memory accounting ----------------
+def memory_kb(pid="self"):
+    # RSS counts shared pages in every process; PSS splits them between sharers,
+    # so summing PSS over workers gives the real aggregate footprint. Values
+    # that /proc cannot give for this pid (non-Linux, old kernels) stay None.
+    out = {"rss_kb": None, "pss_kb": None}
+    for name, field, key in (("status", "VmRSS:", "rss_kb"), ("smaps_rollup", "Pss:", "pss_kb")):
+        try:
+            with open(f"/proc/{pid}/{name}") as f:
+                for line in f:
+                    if line.startswith(field):
+                        out[key] = int(line.split()[1])
+        except OSError:
+            pass
+    return out
+
+
+def _total_kb(stats, key):
+    # None unless every worker reported the value; a partial sum would mislead.
+    values = [s[key] for s in stats]
+    return None if not values or None in values else sum(values)
+
+
+def _fmt_kb(value):
+    return "n/a" if value is None else f"{value:.0f}"
+
+
+# ---------------- Parent: load once ----------------
+def load_shared_state(version=None):
+    # Warm up single-threaded: forking after libgomp has started a thread
+    # pool in the parent can hang OpenMP in the children.
+    bundle = load_bundle(version or discover_versions()[-1], nthread=1, warm=False)
+    MODELS.update(bundle.models)
+    EXPLAINERS.update(bundle.explainers)
+    BACKENDS.update(bundle.backends)
+    for key, model in MODELS.items():
+        dummy = np.zeros((1, len(FEATURES[key])), dtype=float)
+        score_batch(model, dummy, EXPLAINERS[key], BACKENDS[key])
+    # Move everything allocated so far into the permanent generation so the
+    # cyclic GC in the workers does not touch (and so copy) those pages.
+    gc.collect()
+    gc.freeze()
+
+
+def worker_nthread(n_workers, nthread=None):
+    if nthread:
+        return int(nthread)
+    return max(1, (os.cpu_count() or 1) // max(1, n_workers))
+
+
+def _init_worker(nthread):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for model in MODELS.values():
+        set_model_nthread(model, nthread)
+
+
+def score_rows(key, rows):
+    model = MODELS[key]
+    x = np.asarray(rows, dtype=float).reshape(-1, len(FEATURES[key]))
+    pred, proba, shap_matrix = score_batch(model, x, EXPLAINERS[key], BACKENDS[key])
+    classes = getattr(model, "classes_", None)
+    results = []
+    for i in range(x.shape[0]):
+        raw = classes[int(pred[i])] if classes is not None else pred[i]
+        results.append(
+            {
+                "label": format_risk_label(raw),
+                "confidence": float(proba[i, pred[i]]),
+                "proba": [float(p) for p in proba[i]],
+                "shap": dict(zip(FEATURES[key], map(float, shap_matrix[i]))),
+            }
+        )
+    return results
+
+
+# ---------------- Serve mode: pre-fork HTTP ----------------
+class ScoringHandler(BaseHTTPRequestHandler):
+    # POST /score/ds2 or /score/ds3 with {"rows": [[...], ...]} or
+    # {"inputs": {"Age": 25, ...}} (one patient keyed by feature name).
+    def do_POST(self):
+        key = self.path.rstrip("/").rsplit("/", 1)[-1]
+        if key not in MODELS:
+            self._reply(404, {"error": f"unknown model '{key}'"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if "inputs" in body:
+                data = {k: [v] for k, v in body["inputs"].items()}
+            else:
+                data = np.asarray(body["rows"], dtype=object)
+            checked = validate_and_encode(SCHEMAS[key], data)
+            if checked.n_invalid:
+                self._reply(422, {"errors": checked.row_errors(limit=100)})
+                return
+            self._reply(200, {"results": score_rows(key, checked.X), "pid": os.getpid()})
+        except (KeyError, ValueError, TypeError) as exc:
+            self._reply(400, {"error": str(exc)})
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"pid": os.getpid(), **memory_kb()})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve_worker(sock, nthread):
+    _init_worker(nthread)
+    server = HTTPServer(sock.getsockname(), ScoringHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    server.server_name, server.server_port = sock.getsockname()[:2]
+    server.serve_forever()
+
+
+def serve(workers, host, port, nthread=None):
+    load_shared_state()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+
+    ctx = mp.get_context("fork")
+    nthread = worker_nthread(workers, nthread)
+    procs = [ctx.Process(target=_serve_worker, args=(sock, nthread), daemon=True) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    print(f"Serving on http://{host}:{port} with {workers} workers (nthread={nthread} each)")
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+
+
+# ---------------- Bench mode ----------------
+def _bench_worker(nthread, jobs, results):
+    _init_worker(nthread)
+    done = 0
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        key, rows = job
+        score_rows(key, rows)
+        done += 1
+    results.put({"pid": os.getpid(), "requests": done, **memory_kb()})
+
+
+def bench_once(workers, n_requests, nthread=None, seed=0):
+    ctx = mp.get_context("fork")
+    jobs, results = ctx.Queue(), ctx.Queue()
+    nthread = worker_nthread(workers, nthread)
+    procs = [ctx.Process(target=_bench_worker, args=(nthread, jobs, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+
+    rng = np.random.default_rng(seed)
+    keys = rng.choice(["ds2", "ds3"], n_requests)
+    rows = {key: random_records(SCHEMAS[key], n_requests, rng) for key in SCHEMAS}
+    payload = [(str(key), rows[key][i : i + 1]) for i, key in enumerate(keys)]
+
+    start = time.perf_counter()
+    for job in payload:
+        jobs.put(job)
+    for _ in procs:
+        jobs.put(None)
+    stats = [results.get() for _ in procs]
+    elapsed = time.perf_counter() - start
+    for p in procs:
+        p.join()
+
+    return {
+        "workers": workers,
+        "nthread": nthread,
+        "requests": n_requests,
+        "seconds": elapsed,
+        "throughput_rps": n_requests / elapsed if elapsed else float("inf"),
+        "per_worker": stats,
+        "total_rss_kb": _total_kb(stats, "rss_kb"),
+        "total_pss_kb": _total_kb(stats, "pss_kb"),
+    }
+
+
+def bench(worker_counts, n_requests, nthread=None):
+    load_shared_state()
+    parent = memory_kb()
+    print(f"Parent after load: RSS {_fmt_kb(parent['rss_kb'])} kB, PSS {_fmt_kb(parent['pss_kb'])} kB")
+    print(f"{'workers':>7} {'nthread':>7} {'req/s':>10} {'RSS/worker kB':>15} {'sum PSS kB':>12}")
+    reports = []
+    for n in worker_counts:
+        r = bench_once(n, n_requests, nthread)
+        avg_rss = None if r["total_rss_kb"] is None else r["total_rss_kb"] / max(1, len(r["per_worker"]))
+        print(
+            f"{n:>7} {r['nthread']:>7} {r['throughput_rps']:>10.1f} "
+            f"{_fmt_kb(avg_rss):>15} {_fmt_kb(r['total_pss_kb']):>12}"
+        )
+        reports.append(r)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    p_serve = sub.add_parser("serve", help="run the pre-fork HTTP scoring service")
+    p_serve.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8600)
+    p_serve.add_argument("--nthread", type=int, default=None, help="XGBoost threads per worker")
+
+    p_bench = sub.add_parser("bench", help="report RSS per worker and throughput vs worker count")
+    p_bench.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    p_bench.add_argument("--requests", type=int, default=2000)
+    p_bench.add_argument("--nthread", type=int, default=None, help="XGBoost threads per worker")
+    p_bench.add_argument("--json", help="also write the full report to this file")
+
+    args = parser.parse_args()
+    if args.mode == "serve":
+        serve(args.workers, args.host, args.port, args.nthread)
+    else:
+        counts = [int(c) for c in args.workers.split(",") if c.strip()]
+        reports = bench(counts, args.requests, args.nthread)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,25 @@ import streamlit as st
 import numpy as np
 
 from utils import (
-    load_models,
+    EXPLAIN_MODE,
     FEATURES_DS2,
     get_shap_values,
     plot_shap_bar,
     plot_shap_waterfall,
     create_pdf_report,
     format_risk_label,
+    feature_widget,
+    plot_png,
 )
+from audit_log import get_audit_logger
+from drift_monitor import get_drift_monitor
+from model_registry import get_registry
+from memory_guard import current_session_id, get_memory_guard, render_cached_result
+from admission import run_or_defer
+from counterfactual import render_counterfactual_search
+from feature_schema import SCHEMA_DS2, spec_map, encode_record
+
+SPECS = spec_map(SCHEMA_DS2)
 
 
 # -------- Risk color helper (same as general page) --------
@@ -22,9 +33,111 @@ def risk_color(label: str):
     return "#F5B041"       # moderate / other (orange)
 
 
+def render_explanation(bundle, x, row_key, pred, classes, proba, input_data, nice_label):
+    model_ds2 = bundle.models["ds2"]
+    explainer_ds2 = bundle.explainers["ds2"]
+
+    # ===============================================================
+    #                       XAI (SHAP)
+    # ===============================================================
+    st.markdown("### 🧠 Why did the model say this?")
+    st.markdown(
+        "<p class='section-caption'>The following plots highlight which antenatal features most influenced this prediction.</p>",
+        unsafe_allow_html=True,
+    )
+    if EXPLAIN_MODE == "approx":
+        st.caption("Approximate explanation mode: the feature ranking can differ from exact SHAP.")
+
+    shap_values, base_value = bundle.cached(
+        ("ds2", "shap", row_key),
+        lambda: get_shap_values(
+            model_ds2,
+            x,
+            predicted_class_index=int(pred) if classes is not None else None,
+            explainer=explainer_ds2,
+        ),
+    )
+
+    tab_bar, tab_waterfall = st.tabs(["Bar Plot (feature impact)", "Waterfall Plot (step-by-step)"])
+
+    with tab_bar:
+        st.markdown("<div class='shap-card'>", unsafe_allow_html=True)
+        bar_png = plot_png(plot_shap_bar, shap_values, FEATURES_DS2, "Feature impact on prediction")
+        st.image(bar_png, use_container_width=True)
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    with tab_waterfall:
+        st.markdown("<div class='shap-card'>", unsafe_allow_html=True)
+        waterfall_png = plot_png(
+            plot_shap_waterfall, shap_values, base_value, x[0], FEATURES_DS2, "How each feature shifts risk"
+        )
+        st.image(waterfall_png, use_container_width=True)
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    st.markdown("#### In simple terms")
+    st.write(
+        "Bars pushing **to the right** increase the estimated risk, while bars pushing "
+        "**to the left** reduce it."
+    )
+
+    idx_sorted = np.argsort(np.abs(shap_values))[::-1]
+    top3 = idx_sorted[:3]
+    st.write("**Top contributing factors for this pregnancy visit:**")
+    for i in top3:
+        direction = "raised the risk" if shap_values[i] > 0 else "lowered the risk"
+        st.write(f"- **{FEATURES_DS2[i]}** → {direction}")
+
+    # ===============================================================
+    #                       PDF REPORT
+    # ===============================================================
+    st.markdown("### 📄 Download report")
+
+    top5 = idx_sorted[:5]
+    top_contribs = [(FEATURES_DS2[i], float(shap_values[i])) for i in top5]
+
+    proba_dict = (
+        {str(c): float(p) for c, p in zip(classes, proba)}
+        if (proba is not None and classes is not None)
+        else None
+    )
+
+    pdf_buffer = create_pdf_report(
+        model_name="Pregnancy / Antenatal Model",
+        input_dict=input_data,
+        pred_label=nice_label,
+        proba_dict=proba_dict,
+        shap_contribs=top_contribs,
+        model_version=bundle.version,
+    )
+
+    # Keep this result (as bytes, not live figures) within the server memory budget.
+    get_memory_guard().put(
+        current_session_id(),
+        "pregnancy",
+        {
+            "label": nice_label,
+            "bar_png": bar_png,
+            "waterfall_png": waterfall_png,
+            "pdf": pdf_buffer.getvalue(),
+            "shap_values": shap_values,
+            "x": x,
+        },
+    )
+
+    st.download_button(
+        label="⬇️ Download PDF Report",
+        data=pdf_buffer,
+        file_name="maternal_risk_report_pregnancy.pdf",
+        mime="application/pdf",
+        use_container_width=True,
+    )
+
+
 def render_pregnancy_model():
-    # load models (we use model_ds2 here)
-    model_ds2, model_ds3 = load_models()
+    # load models (we use the ds2 model here); one bundle per request, so a model
+    # swap mid-request cannot mix versions.
+    bundle = get_registry().active()
+    backend_ds2 = bundle.backends["ds2"]
 
     st.header("🩺 Pregnancy / Antenatal Model")
     st.markdown(
@@ -40,30 +153,17 @@ def render_pregnancy_model():
     with col_left:
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.markdown("##### Pregnancy details & vitals", unsafe_allow_html=False)
-        age = st.number_input("Age (years)", min_value=10, max_value=60, value=25, step=1)
-        tt_doses = st.number_input("TT doses received", min_value=0, max_value=5, value=2, step=1)
-        gest_age = st.number_input("Gestational age (weeks)", min_value=4, max_value=42, value=20, step=1)
-        weight = st.number_input("Weight (kg)", min_value=30.0, max_value=150.0, value=60.0, step=0.5)
-        systolic = st.number_input("Systolic BP (mmHg)", min_value=70, max_value=220, value=110, step=1)
-        diastolic = st.number_input("Diastolic BP (mmHg)", min_value=40, max_value=130, value=70, step=1)
+        values = {}
+        for name in ["Age", "TT_Doses", "Gestational_Age", "Weight", "Systolic_BP", "Diastolic_BP"]:
+            values[name] = feature_widget(SPECS[name])
         st.markdown("</div>", unsafe_allow_html=True)
 
     # RIGHT COLUMN → Infection markers (card with padding)
     with col_right:
         st.markdown('<div class="card" style="padding-left:1.4rem; padding-right:1.4rem;">', unsafe_allow_html=True)
         st.markdown("##### Infection screening", unsafe_allow_html=False)
-        vdrl = st.radio(
-            "VDRL (Syphilis test)",
-            ["Negative", "Positive"],
-            horizontal=True,
-            index=0,
-        )
-        hbsag = st.radio(
-            "HBsAg (Hepatitis B)",
-            ["Negative", "Positive"],
-            horizontal=True,
-            index=0,
-        )
+        values["VDRL"] = feature_widget(SPECS["VDRL"])
+        values["HBsAg"] = feature_widget(SPECS["HBsAg"])
         st.markdown("</div>", unsafe_allow_html=True)
 
     # ===============================================================
@@ -83,35 +183,27 @@ def render_pregnancy_model():
         return
 
     if not predict_clicked:
+        render_cached_result("pregnancy", "maternal_risk_report_pregnancy.pdf")
         return
 
     # ===============================================================
     #                        PREPARE INPUT VECTOR
     # ===============================================================
-    bin_map = {
-        "Negative": 0,
-        "Positive": 1,
-    }
-
-    input_data = {
-        "Age": age,
-        "TT_Doses": tt_doses,
-        "Gestational_Age": gest_age,
-        "Weight": weight,
-        "VDRL": bin_map[vdrl],
-        "HBsAg": bin_map[hbsag],
-        "Systolic_BP": systolic,
-        "Diastolic_BP": diastolic,
-    }
+    try:
+        input_data = encode_record(SCHEMA_DS2, values)
+    except ValueError as exc:
+        st.error(f"Please check the inputs: {exc}")
+        return
 
     x = np.array([[input_data[f] for f in FEATURES_DS2]], dtype=float)
 
     # ===============================================================
     #                        MODEL PREDICTION
     # ===============================================================
-    pred = model_ds2.predict(x)[0]
-    classes = getattr(model_ds2, "classes_", None)
-    proba = model_ds2.predict_proba(x)[0] if hasattr(model_ds2, "predict_proba") else None
+    row_key = tuple(x[0].tolist())
+    proba = bundle.cached(("ds2", "predict", row_key), lambda: backend_ds2.predict_proba(x)[0])
+    pred = int(np.argmax(proba))
+    classes = backend_ds2.classes_
 
     if classes is not None:
         raw_label = classes[int(pred)]
@@ -121,6 +213,15 @@ def render_pregnancy_model():
     nice_label = format_risk_label(raw_label)
     color = risk_color(nice_label)
 
+    get_audit_logger().log(
+        model_name="Pregnancy / Antenatal Model",
+        input_dict=input_data,
+        pred_label=nice_label,
+        confidence=float(proba[int(pred)]) if proba is not None else None,
+        model_version=bundle.version,
+    )
+    get_drift_monitor().observe("ds2", x[0], pred)
+
     badge_class = "risk-moderate"
     if "low" in nice_label.lower():
         badge_class = "risk-low"
@@ -187,86 +288,16 @@ def render_pregnancy_model():
             for c, p in zip(classes, proba):
                 st.write(f"- {format_risk_label(c)}: `{p:.3f}`")
 
-    # ===============================================================
-    #                       XAI (SHAP)
-    # ===============================================================
-    st.markdown("### 🧠 Why did the model say this?")
-    st.markdown(
-        "<p class='section-caption'>The following plots highlight which antenatal features most influenced this prediction.</p>",
-        unsafe_allow_html=True,
-    )
-
-    shap_values, base_value = get_shap_values(
-        model_ds2,
-        x,
-        predicted_class_index=int(pred) if classes is not None else None,
-    )
-
-    tab_bar, tab_waterfall = st.tabs(["Bar Plot (feature impact)", "Waterfall Plot (step-by-step)"])
-
-    with tab_bar:
-        st.markdown("<div class='shap-card'>", unsafe_allow_html=True)
-        st.pyplot(
-            plot_shap_bar(
-                shap_values,
-                FEATURES_DS2,
-                "Feature impact on prediction",
-            )
-        )
-        st.markdown("</div>", unsafe_allow_html=True)
-
-    with tab_waterfall:
-        st.markdown("<div class='shap-card'>", unsafe_allow_html=True)
-        st.pyplot(
-            plot_shap_waterfall(
-                shap_values,
-                base_value,
-                x[0],
-                FEATURES_DS2,
-                "How each feature shifts risk",
-            )
-        )
-        st.markdown("</div>", unsafe_allow_html=True)
-
-    st.markdown("#### In simple terms")
-    st.write(
-        "Bars pushing **to the right** increase the estimated risk, while bars pushing "
-        "**to the left** reduce it."
-    )
-
-    idx_sorted = np.argsort(np.abs(shap_values))[::-1]
-    top3 = idx_sorted[:3]
-    st.write("**Top contributing factors for this pregnancy visit:**")
-    for i in top3:
-        direction = "raised the risk" if shap_values[i] > 0 else "lowered the risk"
-        st.write(f"- **{FEATURES_DS2[i]}** → {direction}")
+    # ---------------- COUNTERFACTUAL (what would lower the risk?) ----------------
+    if "low" not in nice_label.lower():
+        render_counterfactual_search(bundle, "ds2", x[0])
 
     # ===============================================================
-    #                       PDF REPORT
+    #              EXPLANATION (admission-controlled)
     # ===============================================================
-    st.markdown("### 📄 Download report")
-
-    top5 = idx_sorted[:5]
-    top_contribs = [(FEATURES_DS2[i], float(shap_values[i])) for i in top5]
-
-    proba_dict = (
-        {str(c): float(p) for c, p in zip(classes, proba)}
-        if (proba is not None and classes is not None)
-        else None
-    )
-
-    pdf_buffer = create_pdf_report(
-        model_name="Pregnancy / Antenatal Model",
-        input_dict=input_data,
-        pred_label=nice_label,
-        proba_dict=proba_dict,
-        shap_contribs=top_contribs,
-    )
-
-    st.download_button(
-        label="⬇️ Download PDF Report",
-        data=pdf_buffer,
-        file_name="maternal_risk_report_pregnancy.pdf",
-        mime="application/pdf",
-        use_container_width=True,
+    # The prediction above is already on screen; SHAP, charts and the PDF run
+    # only when a slot is free, otherwise they are offered as "queued".
+    run_or_defer(
+        lambda: render_explanation(bundle, x, row_key, pred, classes, proba, input_data, nice_label),
+        key="pregnancy",
     )
@@ -0,0 +1,122 @@
+# profiling.py
+"""Opt-in cProfile of single Streamlit reruns.
+
+Profiling is off unless MRP_PROFILE=1 (every rerun) or the "Profile reruns"
+toggle in the diagnostics sidebar (?diagnostics=1) is on for the session.
+When off, run_profiled() just calls the page; the only cost is one flag check.
+
+Each profiled rerun is saved as a pstats file under MRP_PROFILE_DIR (default
+"profiles/"), for `python -m pstats` or snakeviz. The top MRP_PROFILE_TOP
+functions by cumulative time are shown below the page.
+
+cProfile sees only the script thread. Work the combined page hands to its
+thread pool shows up as time spent waiting on the futures.
+"""
+import cProfile
+import os
+import pstats
+import threading
+import time
+from datetime import datetime
+
+PROFILE_ALL = os.environ.get("MRP_PROFILE") == "1"
+PROFILE_DIR = os.environ.get("MRP_PROFILE_DIR", "profiles")
+PROFILE_TOP = int(os.environ.get("MRP_PROFILE_TOP", "25"))
+
+# One profiler at a time per process: on Python 3.12+ cProfile cannot be
+# enabled in two threads at once.
+_profiler_lock = threading.Lock()
+
+
+def profiling_enabled():
+    import streamlit as st
+
+    return PROFILE_ALL or bool(st.session_state.get("profile_reruns"))
+
+
+def top_hotspots(stats, limit=PROFILE_TOP):
+    """Top functions by cumulative time as dicts (function, calls, tottime_ms, cumtime_ms)."""
+    stats.sort_stats("cumulative")
+    out = []
+    for func in stats.fcn_list:
+        filename, lineno, name = func
+        if filename == __file__:
+            continue  # the wrapper itself
+        _, ncalls, tottime, cumtime, _ = stats.stats[func]
+        where = f"{os.path.basename(filename)}:{lineno}" if filename != "~" else "built-in"
+        out.append(
+            {
+                "function": f"{name} ({where})",
+                "calls": ncalls,
+                "tottime_ms": round(tottime * 1000, 2),
+                "cumtime_ms": round(cumtime * 1000, 2),
+            }
+        )
+        if len(out) >= limit:
+            break
+    return out
+
+
+def save_profile(profiler, label, session_id):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    session = "".join(c for c in session_id if c.isalnum())[:8]
+    path = os.path.join(PROFILE_DIR, f"rerun-{label.lower()}-{stamp}-{session}.prof")
+    profiler.dump_stats(path)
+    return path
+
+
+def run_profiled(fn, *args, label="rerun"):
+    if not profiling_enabled():
+        return fn(*args)
+
+    import streamlit as st
+    from memory_guard import current_session_id
+
+    if not _profiler_lock.acquire(blocking=False):
+        st.sidebar.caption("Profiler busy in another session; this rerun was not profiled.")
+        return fn(*args)
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+        try:
+            result = fn(*args)
+        finally:
+            profiler.disable()
+    except BaseException:
+        # st.rerun()/st.stop() end the script with an exception; keep the file.
+        save_profile(profiler, label, current_session_id())
+        raise
+    finally:
+        _profiler_lock.release()
+
+    elapsed = time.perf_counter() - start
+    path = save_profile(profiler, label, current_session_id())
+    render_profile(pstats.Stats(profiler), elapsed, path)
+    return result
+
+
+def render_profile(stats, elapsed, path):
+    import streamlit as st
+
+    with st.expander(f"⏱ Profile of this rerun: {elapsed * 1000:.0f} ms", expanded=True):
+        st.caption(f"Saved to `{path}` (open with `python -m pstats {path}` or snakeviz).")
+        st.table(top_hotspots(stats))
+        with open(path, "rb") as f:
+            st.download_button(
+                label="⬇️ Download profile",
+                data=f.read(),
+                file_name=os.path.basename(path),
+                mime="application/octet-stream",
+                key="download_profile",
+            )
+
+
+def render_profiling_toggle():
+    import streamlit as st
+
+    if PROFILE_ALL:
+        st.markdown("Every rerun is profiled (`MRP_PROFILE=1`).")
+        return
+    st.toggle("Profile reruns", key="profile_reruns", help="cProfile each rerun of the page and show the hotspots")
@@ -1,9 +1,10 @@
 # utils.py
+import os
 import streamlit as st
 import numpy as np
 import pickle
 import shap
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from io import BytesIO
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
@@ -154,18 +155,108 @@ def apply_global_css():
 
 
 
+# ---------------- Input widgets ----------------
+def feature_widget(spec, key=None):
+    # Build the Streamlit input for one feature_schema.FeatureSpec; returns the
+    # raw widget value (a number, or the selected choice label).
+    if spec.is_choice:
+        return st.radio(
+            spec.label,
+            list(spec.choices),
+            horizontal=True,
+            index=spec.choices.index(spec.default),
+            key=key,
+        )
+    if spec.kind == "int":
+        return st.number_input(
+            spec.label,
+            min_value=int(spec.min_value),
+            max_value=int(spec.max_value),
+            value=int(spec.default),
+            step=int(spec.step),
+            key=key,
+        )
+    return st.number_input(
+        spec.label,
+        min_value=float(spec.min_value),
+        max_value=float(spec.max_value),
+        value=float(spec.default),
+        step=float(spec.step),
+        key=key,
+    )
+
+
 # ---------------- Model loading ----------------
-@st.cache_resource
-def load_models():
-    with open("best_xgbc_modelds2.pkl", "rb") as f:
+MODEL_DS2_PATH = "best_xgbc_modelds2.pkl"
+MODEL_DS3_PATH = "best_xgbc_model3.pkl"
+
+
+def read_models(ds2_path=MODEL_DS2_PATH, ds3_path=MODEL_DS3_PATH):
+    # The app gets its models through model_registry; this is the raw loader.
+    with open(ds2_path, "rb") as f:
         model_ds2 = pickle.load(f)
-    with open("best_xgbc_model3.pkl", "rb") as f:
+    with open(ds3_path, "rb") as f:
         model_ds3 = pickle.load(f)
     return model_ds2, model_ds3
 
+
+# XGBoost threads per predict call. Every Streamlit session predicts in its own
+# thread, so the default of 1 keeps concurrent sessions from oversubscribing.
+XGB_NTHREAD = int(os.environ.get("MRP_XGB_NTHREAD", "1"))
+
+
+def set_model_nthread(model, nthread):
+    # Limit the OpenMP threads XGBoost uses for predict on this model.
+    # Plain attribute assignment: set_params() needs every constructor attribute,
+    # which models pickled by older xgboost versions may not have.
+    nthread = max(1, int(nthread))
+    if hasattr(model, "n_jobs"):
+        model.n_jobs = nthread
+    if hasattr(model, "get_booster"):
+        model.get_booster().set_param({"nthread": nthread})
+    return model
+
 # ---------------- SHAP helpers ----------------
-def get_shap_values(model, x_array, predicted_class_index=None):
-    explainer = shap.TreeExplainer(model)
+# "exact" is TreeSHAP. "approx" is Saabas-style path attribution computed by
+# the booster itself (approx_contribs): much faster, with a slightly different
+# feature ranking; explain_eval.py measures both.
+EXPLAIN_MODES = ("exact", "approx")
+EXPLAIN_MODE = os.environ.get("MRP_EXPLAIN_MODE", "exact")
+
+
+def build_explainer(model):
+    return shap.TreeExplainer(model)
+
+
+def approx_contribs(model, x_array):
+    # Per-feature contributions and bias in margin space, like TreeSHAP:
+    # (rows, features) and (rows,), or (rows, features, classes) and (rows, classes).
+    import xgboost as xgb
+
+    contribs = model.get_booster().predict(xgb.DMatrix(x_array), pred_contribs=True, approx_contribs=True)
+    values, bias = contribs[..., :-1], contribs[..., -1]
+    if values.ndim == 3:
+        values = np.moveaxis(values, 1, 2)
+    return values, bias
+
+
+def _explain_mode(mode):
+    mode = mode or EXPLAIN_MODE
+    if mode not in EXPLAIN_MODES:
+        raise ValueError(f"unknown explanation mode '{mode}' (expected one of {', '.join(EXPLAIN_MODES)})")
+    return mode
+
+
+def get_shap_values(model, x_array, predicted_class_index=None, explainer=None, mode=None):
+    if _explain_mode(mode) == "approx":
+        values, bias = approx_contribs(model, x_array)
+        if values.ndim == 3:
+            k = predicted_class_index or 0
+            return values[0, :, k], float(bias[0, k])
+        return values[0], float(bias[0])
+
+    if explainer is None:
+        explainer = build_explainer(model)
     shap_values = explainer.shap_values(x_array)
 
     if isinstance(shap_values, list):
@@ -184,39 +275,104 @@ def get_shap_values(model, x_array, predicted_class_index=None):
     return shap_instance, base_value
 
 
+def select_class_shap(shap_values, class_index):
+    # Per-row SHAP matrix (n_rows, n_features) for the given class index per row.
+    # Handles both the list-of-arrays and the (rows, features, classes) layouts.
+    class_index = np.asarray(class_index, dtype=int)
+    if isinstance(shap_values, list):
+        stacked = np.stack(shap_values, axis=-1)
+    else:
+        stacked = np.asarray(shap_values)
+    if stacked.ndim == 2:
+        return stacked
+    rows = np.arange(stacked.shape[0])
+    return stacked[rows, :, class_index]
+
+
+def score_batch(model, x_array, explainer=None, backend=None, mode=None):
+    # Predict and explain a block of rows; returns (pred, proba, shap_matrix).
+    # `backend` (inference_backend.py) computes the probabilities if given.
+    proba = (backend or model).predict_proba(x_array)
+    pred = np.argmax(proba, axis=1)
+    if _explain_mode(mode) == "approx":
+        return pred, proba, select_class_shap(approx_contribs(model, x_array)[0], pred)
+    if explainer is None:
+        explainer = build_explainer(model)
+    shap_matrix = select_class_shap(explainer.shap_values(x_array), pred)
+    return pred, proba, shap_matrix
+
+
+# Charts are drawn on standalone Figures, never through pyplot: pyplot's
+# figure registry is process-global, and Streamlit calls plt.close("all") at
+# the end of every rerun, which would destroy another session's figure midway.
+SHAP_POSITIVE = "#ff0051"  # shap's colours for raising / lowering the output
+SHAP_NEGATIVE = "#008bfb"
+
+
 def plot_shap_bar(shap_values, feature_names, title):
     idx_sorted = np.argsort(np.abs(shap_values))
     shap_sorted = shap_values[idx_sorted]
     feat_sorted = np.array(feature_names)[idx_sorted]
 
-    fig, ax = plt.subplots(figsize=(7, 5))
+    fig = Figure(figsize=(7, 5))
+    ax = fig.subplots()
     ax.barh(feat_sorted, shap_sorted)
     ax.set_xlabel("SHAP value (impact on prediction)")
     ax.set_title(title)
-    plt.tight_layout()
+    fig.tight_layout()
     return fig
 
 
 def plot_shap_waterfall(shap_values, base_value, x_row, feature_names, title):
-    explanation = shap.Explanation(
-        values=shap_values,
-        base_values=base_value,
-        data=x_row,
-        feature_names=feature_names,
-    )
-    fig, ax = plt.subplots(figsize=(7, 5))
-    shap.plots.waterfall(explanation, show=False)
-    plt.title(title)
-    plt.tight_layout()
+    # Same layout as shap.plots.waterfall (which only draws on the current
+    # pyplot figure): the smallest contribution at the bottom starts from the
+    # base value, and the bars stack up to the model output at the top.
+    values = np.asarray(shap_values, dtype=float)
+    order = np.argsort(np.abs(values))
+    contrib = values[order]
+    starts = base_value + np.cumsum(contrib) - contrib
+    output = base_value + values.sum()
+    labels = [f"{x_row[i]:g} = {feature_names[i]}" for i in order]
+    y = np.arange(len(order))
+
+    fig = Figure(figsize=(7, 5))
+    ax = fig.subplots()
+    ax.barh(y, contrib, left=starts, color=np.where(contrib > 0, SHAP_POSITIVE, SHAP_NEGATIVE), height=0.6)
+    ends = starts + contrib
+    lo = min(starts.min(), ends.min(), base_value)
+    hi = max(starts.max(), ends.max(), base_value)
+    pad = 0.12 * (hi - lo or 1.0)
+    for yi, start, end, v in zip(y, starts, ends, contrib):
+        if abs(v) > 0.1 * (hi - lo):  # label inside the bar when it fits
+            ax.text((start + end) / 2, yi, f"{v:+.2f}", va="center", ha="center", color="white", fontsize=9)
+        else:
+            ax.text(end, yi, f" {v:+.2f} ", va="center", ha="left" if v > 0 else "right", fontsize=9)
+    ax.axvline(base_value, color="#999999", linestyle="--", linewidth=0.8)
+    ax.axvline(output, color="#999999", linestyle="--", linewidth=0.8)
+    ax.set_yticks(y, labels)
+    ax.set_xlim(lo - pad, hi + pad)
+    ax.set_xlabel(f"E[f(X)] = {base_value:.3f}   f(x) = {output:.3f}")
+    for side in ("top", "right", "left"):
+        ax.spines[side].set_visible(False)
+    ax.set_title(title)
+    fig.tight_layout()
     return fig
 
-# ---------------- PDF report ----------------
-def create_pdf_report(model_name, input_dict, pred_label, proba_dict=None, shap_contribs=None):
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    y = height - 50
 
+def figure_png(fig):
+    # Render a figure to PNG bytes. Figures here are not tracked by pyplot, so
+    # they are freed with their last reference.
+    buf = BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    return buf.getvalue()
+
+
+def plot_png(plot, *args):
+    # Draw with one of the plot_shap_* functions and return the PNG bytes.
+    return figure_png(plot(*args))
+
+# ---------------- PDF report ----------------
+def _draw_report_header(c, y, model_name, model_version=None):
     # ---------- Title ----------
     c.setFont("Helvetica-Bold", 18)
     c.drawString(50, y, "Maternal Risk Prediction Report")
@@ -225,6 +381,9 @@ def create_pdf_report(model_name, input_dict, pred_label, proba_dict=None, shap_
     c.setFont("Helvetica", 10)
     c.drawString(50, y, f"Model: {model_name}")
     y -= 15
+    if model_version:
+        c.drawString(50, y, f"Model version: {model_version}")
+        y -= 15
     c.drawString(50, y, f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     y -= 20
 
@@ -232,6 +391,10 @@ def create_pdf_report(model_name, input_dict, pred_label, proba_dict=None, shap_
     c.drawString(50, y, "This report is a decision-support tool and does not replace clinical judgement.")
     y -= 25
 
+    return y
+
+
+def _draw_assessment(c, y, height, input_dict, pred_label, proba_dict=None, shap_contribs=None):
     # ---------- Risk summary ----------
     lower_label = str(pred_label).lower()
     is_high = "high" in lower_label
@@ -337,6 +500,10 @@ def create_pdf_report(model_name, input_dict, pred_label, proba_dict=None, shap_
                 c.showPage()
                 y = height - 50
 
+    return y
+
+
+def _draw_notice(c, y, height):
     # ---------- Final note ----------
     if y < 100:
         c.showPage()
@@ -358,6 +525,56 @@ def create_pdf_report(model_name, input_dict, pred_label, proba_dict=None, shap_
         "It should not be used as the sole basis for diagnosis or treatment decisions."
     )
 
+
+def create_pdf_report(model_name, input_dict, pred_label, proba_dict=None, shap_contribs=None, model_version=None):
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    y = height - 50
+
+    y = _draw_report_header(c, y, model_name, model_version)
+    y = _draw_assessment(c, y, height, input_dict, pred_label, proba_dict, shap_contribs)
+    _draw_notice(c, y, height)
+
+    c.showPage()
+    c.save()
+    buffer.seek(0)
+    return buffer
+
+
+def create_combined_pdf_report(assessments, model_name="Combined Antenatal Assessment"):
+    # One report for several models; `assessments` is a list of dicts with the
+    # create_pdf_report() arguments (model_name, input_dict, pred_label, ...).
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    y = height - 50
+
+    versions = sorted({str(a["model_version"]) for a in assessments if a.get("model_version")})
+    y = _draw_report_header(c, y, model_name, ", ".join(versions) or None)
+
+    for a in assessments:
+        if y < 160:
+            c.showPage()
+            y = height - 50
+        c.setFont("Helvetica-Bold", 14)
+        c.setFillColor(colors.HexColor("#154360"))
+        c.drawString(50, y, a["model_name"])
+        c.setFillColor(colors.black)
+        y -= 25
+        y = _draw_assessment(
+            c,
+            y,
+            height,
+            a["input_dict"],
+            a["pred_label"],
+            a.get("proba_dict"),
+            a.get("shap_contribs"),
+        )
+        y -= 10
+
+    _draw_notice(c, y, height)
+
     c.showPage()
     c.save()
     buffer.seek(0)
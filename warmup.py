@@ -0,0 +1,160 @@
+# warmup.py
+"""Start-up warm-up for the Streamlit app.
+
+`warm_up()` loads the active model version from the registry (both models and
+their SHAP explainers) and pushes one dummy patient through predict / explain /
+plot / PDF so XGBoost, SHAP, Matplotlib and ReportLab do their one-off
+initialisation before the first real click. It is cached per process, so app.py
+can call it on every rerun. The registry runs the same warm-up on every new
+model version before swapping it in.
+
+    python warmup.py serve --port 8501   # warm up, then start the server
+    python warmup.py measure             # first-request latency, cold vs warm
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+import numpy as np
+import streamlit as st
+
+from feature_schema import SCHEMA_DS2, SCHEMA_DS3, random_records
+from utils import (
+    FEATURES_DS2,
+    FEATURES_DS3,
+    create_pdf_report,
+    format_risk_label,
+    get_shap_values,
+    plot_shap_bar,
+    plot_shap_waterfall,
+    plot_png,
+)
+
+
+def default_row(schema):
+    row = []
+    for spec in schema:
+        row.append(spec.choices.index(spec.default) if spec.is_choice else spec.default)
+    return np.array([row], dtype=float)
+
+
+def run_pipeline(model, explainer, features, x, model_name):
+    # The same stages a page runs after "Predict & Explain".
+    proba = model.predict_proba(x)[0]
+    pred = int(np.argmax(proba))
+    label = format_risk_label(model.classes_[pred] if hasattr(model, "classes_") else pred)
+    shap_values, base_value = get_shap_values(model, x, pred, explainer=explainer)
+    plot_png(plot_shap_bar, shap_values, features, "Feature impact on prediction")
+    plot_png(plot_shap_waterfall, shap_values, base_value, x[0], features, "How each feature shifts risk")
+    top = np.argsort(np.abs(shap_values))[::-1][:5]
+    create_pdf_report(
+        model_name=model_name,
+        input_dict=dict(zip(features, x[0].tolist())),
+        pred_label=label,
+        proba_dict={str(c): float(p) for c, p in zip(getattr(model, "classes_", []), proba)},
+        shap_contribs=[(features[i], float(shap_values[i])) for i in top],
+    )
+    return label
+
+
+def warm_bundle(bundle):
+    # One dummy request per model of a model_registry.ModelBundle.
+    run_pipeline(bundle.models["ds2"], bundle.explainers["ds2"], FEATURES_DS2, default_row(SCHEMA_DS2), "Pregnancy / Antenatal Model")
+    run_pipeline(bundle.models["ds3"], bundle.explainers["ds3"], FEATURES_DS3, default_row(SCHEMA_DS3), "General Maternal Model")
+
+
+@st.cache_resource(show_spinner=False)
+def warm_up():
+    from model_registry import get_registry
+
+    t0 = time.perf_counter()
+    bundle = get_registry().active()
+    return {"version": bundle.version, "load_and_warm": time.perf_counter() - t0}
+
+
+# ---------------- Measurement ----------------
+def _first_request(warm):
+    # Runs in a fresh interpreter; prints JSON timings for the first real request.
+    out = {}
+    if warm:
+        t0 = time.perf_counter()
+        out["warm_up"] = warm_up()
+        out["warm_up_total"] = time.perf_counter() - t0
+
+    from model_registry import discover_versions, get_registry, load_bundle
+
+    rng = np.random.default_rng(1)
+    t0 = time.perf_counter()
+    if warm:
+        bundle = get_registry().active()
+    else:
+        bundle = load_bundle(discover_versions()[-1], warm=False)
+    model_ds2, model_ds3 = bundle.models["ds2"], bundle.models["ds3"]
+    explainer_ds2, explainer_ds3 = bundle.explainers["ds2"], bundle.explainers["ds3"]
+    run_pipeline(model_ds3, explainer_ds3, FEATURES_DS3, random_records(SCHEMA_DS3, 1, rng), "General Maternal Model")
+    out["first_request"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    run_pipeline(model_ds2, explainer_ds2, FEATURES_DS2, random_records(SCHEMA_DS2, 1, rng), "Pregnancy / Antenatal Model")
+    out["second_model_first_request"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    run_pipeline(model_ds3, explainer_ds3, FEATURES_DS3, random_records(SCHEMA_DS3, 1, rng), "General Maternal Model")
+    out["steady_state_request"] = time.perf_counter() - t0
+    print(json.dumps(out))
+
+
+def measure():
+    results = {}
+    for mode in ("cold", "warm"):
+        proc = subprocess.run(
+            [sys.executable, __file__, "_first-request", mode],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        results[mode] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    print(f"{'':34}{'cold (lazy)':>14}{'warmed':>14}")
+    for key in ("first_request", "second_model_first_request", "steady_state_request"):
+        cold, warm = results["cold"][key], results["warm"][key]
+        print(f"{key:34}{cold * 1000:>11.1f} ms{warm * 1000:>11.1f} ms")
+    print(f"warm-up cost at start-up: {results['warm']['warm_up_total'] * 1000:.1f} ms")
+    return results
+
+
+def serve(port=None):
+    # Warm this process's st.cache_resource entries, then start the server in it,
+    # so the port only opens once the models are ready.
+    from streamlit.web import bootstrap
+
+    timings = warm_up()
+    print(f"Warm-up done: model version {timings['version']} in {timings['load_and_warm'] * 1000:.0f} ms")
+    flag_options = {"server.port": port} if port else {}
+    bootstrap.load_config_options(flag_options=flag_options)
+    bootstrap.run(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"), False, [], flag_options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["serve", "measure", "_first-request"])
+    parser.add_argument("variant", nargs="?", default="cold", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        serve(args.port)
+    elif args.mode == "measure":
+        measure()
+    else:
+        _first_request(args.variant == "warm")
+
+
+if __name__ == "__main__":
+    main()